@@ -0,0 +1,337 @@
+import argparse
+import hashlib
+import json
+import os
+
+from quirks import get_profile
+
+cache_version = 2
+
+
+def disassemble(op_code, quirks=None):
+    """
+    Mnemonic for one instruction
+    :param op_code: 16 bit instruction
+    :param quirks: profile name or Quirks, the SCHIP instructions are only known on the extended profiles
+    :return: str
+    """
+    extended = quirks is not None and get_profile(quirks).extended
+    x = (op_code & 0x0F00) >> 8
+    y = (op_code & 0x00F0) >> 4
+    n = op_code & 0x000F
+    nn = op_code & 0x00FF
+    nnn = op_code & 0x0FFF
+    match op_code & 0xF000:
+        case 0x0000:
+            match op_code:
+                case 0x00E0:
+                    return "CLS"
+                case 0x00EE:
+                    return "RET"
+                case 0x00FB if extended:
+                    return "SCR"
+                case 0x00FC if extended:
+                    return "SCL"
+                case 0x00FD if extended:
+                    return "EXIT"
+                case 0x00FE if extended:
+                    return "LOW"
+                case 0x00FF if extended:
+                    return "HIGH"
+                case _ if extended and op_code & 0xFFF0 == 0x00C0:
+                    return f"SCD {n}"
+        case 0x1000:
+            return f"JP 0x{nnn:03X}"
+        case 0x2000:
+            return f"CALL 0x{nnn:03X}"
+        case 0x3000:
+            return f"SE V{x:X}, 0x{nn:02X}"
+        case 0x4000:
+            return f"SNE V{x:X}, 0x{nn:02X}"
+        case 0x5000:
+            return f"SE V{x:X}, V{y:X}"
+        case 0x6000:
+            return f"LD V{x:X}, 0x{nn:02X}"
+        case 0x7000:
+            return f"ADD V{x:X}, 0x{nn:02X}"
+        case 0x8000:
+            match n:
+                case 0x0:
+                    return f"LD V{x:X}, V{y:X}"
+                case 0x1:
+                    return f"OR V{x:X}, V{y:X}"
+                case 0x2:
+                    return f"AND V{x:X}, V{y:X}"
+                case 0x3:
+                    return f"XOR V{x:X}, V{y:X}"
+                case 0x4:
+                    return f"ADD V{x:X}, V{y:X}"
+                case 0x5:
+                    return f"SUB V{x:X}, V{y:X}"
+                case 0x6:
+                    return f"SHR V{x:X}"
+                case 0x7:
+                    return f"SUBN V{x:X}, V{y:X}"
+                case 0xE:
+                    return f"SHL V{x:X}"
+        case 0x9000:
+            return f"SNE V{x:X}, V{y:X}"
+        case 0xA000:
+            return f"LD I, 0x{nnn:03X}"
+        case 0xB000:
+            return f"JP V0, 0x{nnn:03X}"
+        case 0xC000:
+            return f"RND V{x:X}, 0x{nn:02X}"
+        case 0xD000:
+            return f"DRW V{x:X}, V{y:X}, {n}"
+        case 0xE000:
+            match nn:
+                case 0x9E:
+                    return f"SKP V{x:X}"
+                case 0xA1:
+                    return f"SKNP V{x:X}"
+        case 0xF000:
+            match nn:
+                case 0x07:
+                    return f"LD V{x:X}, DT"
+                case 0x0A:
+                    return f"LD V{x:X}, K"
+                case 0x15:
+                    return f"LD DT, V{x:X}"
+                case 0x18:
+                    return f"LD ST, V{x:X}"
+                case 0x1E:
+                    return f"ADD I, V{x:X}"
+                case 0x29:
+                    return f"LD F, V{x:X}"
+                case 0x30 if extended:
+                    return f"LD HF, V{x:X}"
+                case 0x33:
+                    return f"LD B, V{x:X}"
+                case 0x55:
+                    return f"LD [I], V{x:X}"
+                case 0x65:
+                    return f"LD V{x:X}, [I]"
+                case 0x75 if extended:
+                    return f"LD R, V{x:X}"
+                case 0x85 if extended:
+                    return f"LD V{x:X}, R"
+    return f"DW 0x{op_code:04X}"
+
+
+def successors(pc, op_code, quirks=None):
+    """
+    Where control can go after an instruction, as far as can be known statically
+    :param pc: address of the instruction
+    :param op_code: 16 bit instruction
+    :param quirks: profile name or Quirks
+    :return: (list of addresses, whether the instruction ends a basic block)
+    """
+    match op_code & 0xF000:
+        case 0x1000:
+            return [op_code & 0x0FFF], True
+        case 0x2000:
+            return [op_code & 0x0FFF, pc + 2], True
+        case 0x3000 | 0x4000 | 0x5000 | 0x9000:
+            return [pc + 2, pc + 4], True
+        case 0xB000:
+            return [], True
+        case 0xE000 if op_code & 0xFF in (0x9E, 0xA1):
+            return [pc + 2, pc + 4], True
+    if op_code == 0x00EE or op_code == 0x00FD or disassemble(op_code, quirks).startswith("DW"):
+        return [], True
+    return [pc + 2], False
+
+
+class Analysis:
+    """
+    Result of analyzing a rom: basic blocks, control flow edges, indirect jumps and data regions
+    """
+
+    def __init__(self, rom_hash, blocks, indirect, data, quirks="default"):
+        self.rom_hash = rom_hash
+        self.quirks = quirks
+        self.blocks = blocks
+        self.indirect = indirect
+        self.data = data
+
+    def edges(self):
+        """
+        Control flow edges between block start addresses
+        :return: list of (from, to)
+        """
+        return [(start, target) for start, block in sorted(self.blocks.items()) for target in block["successors"]]
+
+    def listing(self):
+        """
+        Disassembly listing of every reachable block
+        :return: str
+        """
+        lines = []
+        for start, block in sorted(self.blocks.items()):
+            lines.append(f"block_{start:03X}:")
+            for pc, op_code in block["instructions"]:
+                lines.append(f"    0x{pc:03X}  {op_code:04X}  {disassemble(op_code, self.quirks)}")
+            if pc in self.indirect:
+                lines.append("    ; indirect jump, targets unknown")
+        for start, end in self.data:
+            lines.append(f"data 0x{start:03X}-0x{end - 1:03X}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        """
+        JSON friendly form
+        :return: dict
+        """
+        return {
+            "version": cache_version,
+            "rom": self.rom_hash,
+            "quirks": self.quirks,
+            "blocks": {str(start): block for start, block in self.blocks.items()},
+            "indirect": self.indirect,
+            "data": self.data,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild from to_dict output
+        :param data: dict
+        :return: Analysis
+        """
+        blocks = {int(start): {"end": block["end"], "successors": block["successors"],
+                               "instructions": [tuple(ins) for ins in block["instructions"]]}
+                  for start, block in data["blocks"].items()}
+        return cls(data["rom"], blocks, data["indirect"], [tuple(region) for region in data["data"]], data["quirks"])
+
+
+def analyze(rom, origin=0x200, quirks="default"):
+    """
+    Recursive descent from the entry point, following jumps, calls and skips. BNNN targets cannot be followed and are
+    reported as indirect; rom bytes never reached as code are reported as data regions
+    :param rom: rom bytes
+    :param origin: load address and entry point
+    :param quirks: profile name or Quirks the rom is written for
+    :return: Analysis
+    """
+    quirks = get_profile(quirks)
+    end = origin + len(rom)
+
+    def fetch(pc):
+        return rom[pc - origin] << 8 | rom[pc - origin + 1]
+
+    code = {}
+    leaders = {origin}
+    work = [origin]
+    indirect = []
+    while work:
+        pc = work.pop()
+        while origin <= pc < end - 1 and pc not in code:
+            op_code = fetch(pc)
+            code[pc] = op_code
+            targets, ends = successors(pc, op_code, quirks)
+            if op_code & 0xF000 == 0xB000:
+                indirect.append(pc)
+            if ends:
+                for target in targets:
+                    leaders.add(target)
+                    work.append(target)
+                break
+            pc += 2
+        else:
+            if pc in code:
+                leaders.add(pc)
+
+    blocks = {}
+    for start in sorted(leader for leader in leaders if leader in code):
+        instructions = []
+        pc = start
+        while True:
+            op_code = code[pc]
+            instructions.append((pc, op_code))
+            targets, ends = successors(pc, op_code, quirks)
+            if ends or pc + 2 in leaders or pc + 2 not in code:
+                break
+            pc += 2
+        if not ends:
+            targets = [target for target in targets if target in code]
+        blocks[start] = {"end": pc + 2, "successors": targets, "instructions": instructions}
+
+    covered = bytearray(len(rom))
+    for pc in code:
+        covered[pc - origin] = covered[pc - origin + 1] = 1
+    data = []
+    pos = 0
+    while pos < len(rom):
+        if covered[pos]:
+            pos += 1
+            continue
+        start = pos
+        while pos < len(rom) and not covered[pos]:
+            pos += 1
+        data.append((origin + start, origin + pos))
+
+    return Analysis(hashlib.sha256(rom).hexdigest(), blocks, sorted(indirect), data, quirks.name)
+
+
+def analyze_cached(rom, cache_dir, quirks="default"):
+    """
+    Analyze a rom, reusing an earlier result stored on disk under the rom content hash and quirks profile
+    :param rom: rom bytes
+    :param cache_dir: directory for cached analyses
+    :param quirks: profile name or Quirks the rom is written for
+    :return: Analysis
+    """
+    quirks = get_profile(quirks)
+    path = os.path.join(cache_dir, f"{hashlib.sha256(rom).hexdigest()}-{quirks.name}.json")
+    try:
+        with open(path) as file:
+            data = json.load(file)
+        if data.get("version") == cache_version:
+            return Analysis.from_dict(data)
+    except (FileNotFoundError, ValueError):
+        pass
+    analysis = analyze(rom, quirks=quirks)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(analysis.to_dict(), file)
+    return analysis
+
+
+def predecode(cpu, analysis):
+    """
+    Compile every reachable instruction into the opcode table and, on the block decoder, translate every basic block
+    ahead of execution
+    :param cpu: CPU with the rom loaded
+    :param analysis: Analysis of that rom under the CPU's quirks profile
+    :return: None
+    """
+    if analysis.quirks != cpu.quirks.name:
+        raise ValueError(f"Analysis is for the {analysis.quirks} profile, the CPU runs {cpu.quirks.name}")
+    for block in analysis.blocks.values():
+        for _, op_code in block["instructions"]:
+            cpu.opcode_table[op_code]
+    if cpu.blocks is not None:
+        for start in analysis.blocks:
+            cpu.blocks.translate(cpu.memory, start)
+
+
+def main():
+    """
+    Print the disassembly listing of a rom
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Disassemble and analyze a Chip-8 rom")
+    parser.add_argument("rom", help="rom file")
+    parser.add_argument("--cache", help="directory to cache analyses in")
+    parser.add_argument("--json", action="store_true", help="print the analysis as JSON")
+    parser.add_argument("--quirks", default="default", help="quirks profile the rom is written for")
+    args = parser.parse_args()
+    with open(args.rom, "rb") as file:
+        rom = file.read()
+    analysis = analyze_cached(rom, args.cache, args.quirks) if args.cache else analyze(rom, quirks=args.quirks)
+    print(json.dumps(analysis.to_dict(), indent=1) if args.json else analysis.listing())
+
+
+if __name__ == '__main__':
+    main()
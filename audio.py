@@ -0,0 +1,235 @@
+import threading
+import wave
+from array import array
+
+sample_rate = 44100
+
+
+class Tone:
+    """
+    The Chip-8 beep: a square wave at a fixed pitch. One second of the wave is built up front and sliced, so making a
+    frame of sound costs a copy
+    """
+
+    def __init__(self, frequency=440, rate=sample_rate, volume=0.25):
+        level = int(32767 * volume)
+        period = rate / frequency
+        self.table = array("h", (level if (pos % period) < period / 2 else -level for pos in range(rate))).tobytes()
+        self.pos = 0
+
+    def samples(self, count):
+        """
+        Continue the wave
+        :param count: number of samples
+        :return: bytes of 16 bit little endian mono samples
+        """
+        table = self.table
+        out = bytearray()
+        while count:
+            take = min(count, len(table) // 2 - self.pos)
+            out += table[self.pos * 2:(self.pos + take) * 2]
+            self.pos = (self.pos + take) % (len(table) // 2)
+            count -= take
+        return bytes(out)
+
+
+class PatternTone:
+    """
+    XO-CHIP style audio: a 128 bit pattern played one bit per step at 4000 * 2 ** ((pitch - 64) / 48) steps a second
+    """
+
+    def __init__(self, pattern=bytes([0x00, 0xFF] * 8), pitch=64, rate=sample_rate, volume=0.25):
+        self.level = int(32767 * volume)
+        self.rate = rate
+        self.phase = 0.0
+        self.set_pattern(pattern, pitch)
+
+    def set_pattern(self, pattern, pitch=None):
+        """
+        Change the pattern and optionally the pitch, keeping the playback position
+        :param pattern: 16 bytes
+        :param pitch: 0-255
+        :return: None
+        """
+        if len(pattern) != 16:
+            raise ValueError(f"Expected a 16 byte pattern, got {len(pattern)}")
+        self.bits = [(byte >> (7 - bit)) & 1 for byte in pattern for bit in range(8)]
+        if pitch is not None:
+            self.step = 4000 * 2 ** ((pitch - 64) / 48) / self.rate
+
+    def samples(self, count):
+        """
+        Continue the pattern
+        :param count: number of samples
+        :return: bytes of 16 bit little endian mono samples
+        """
+        bits, level, step, phase = self.bits, self.level, self.step, self.phase
+        out = array("h", (level if bits[int(phase + pos * step) & 127] else -level for pos in range(count)))
+        self.phase = (phase + count * step) % 128
+        return out.tobytes()
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of 16 bit samples between the emulator and an output stage. Writes never wait: when the buffer is
+    full the oldest samples are dropped. Reads never wait either: a short buffer is padded with silence. Both are
+    counted, and the lock is only held for the copy so a device callback thread can read safely
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = bytearray()
+        self.lock = threading.Lock()
+        self.overruns = 0
+        self.underruns = 0
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def write(self, samples):
+        """
+        Append samples, dropping the oldest ones that no longer fit
+        :param samples: bytes of 16 bit samples
+        :return: None
+        """
+        with self.lock:
+            self.data += samples
+            excess = len(self.data) - self.capacity * 2
+            if excess > 0:
+                del self.data[:excess]
+                self.overruns += excess // 2
+
+    def read(self, count):
+        """
+        Take samples from the front, padded with silence if fewer are buffered
+        :param count: number of samples
+        :return: bytes of count samples
+        """
+        with self.lock:
+            out = bytes(self.data[:count * 2])
+            del self.data[:count * 2]
+        if len(out) < count * 2:
+            self.underruns += count - len(out) // 2
+            out += bytes(count * 2 - len(out))
+        return out
+
+
+class NullAudioSink:
+    """
+    Audio sink that discards every sample, for headless runs
+    """
+
+    latency_frames = 0
+
+    def __init__(self):
+        self.samples = 0
+
+    def write(self, samples):
+        """
+        Play samples
+        :param samples: bytes of 16 bit little endian mono samples
+        :return: None
+        """
+        self.samples += len(samples) // 2
+
+    def close(self):
+        """
+        Release the output
+        :return: None
+        """
+
+
+class WavAudioSink(NullAudioSink):
+    """
+    Audio sink that writes a mono 16 bit WAV file
+    """
+
+    def __init__(self, path, rate=sample_rate):
+        super().__init__()
+        self.file = wave.open(str(path), "wb")
+        self.file.setnchannels(1)
+        self.file.setsampwidth(2)
+        self.file.setframerate(rate)
+
+    def write(self, samples):
+        """
+        Append samples to the file
+        :param samples: bytes of 16 bit little endian mono samples
+        :return: None
+        """
+        super().write(samples)
+        self.file.writeframesraw(samples)
+
+    def close(self):
+        """
+        Finish the file header and close it
+        :return: None
+        """
+        self.file.close()
+
+
+class Audio:
+    """
+    Turns the sound timer into samples, one 60 Hz frame at a time. Each frame's samples go into a ring buffer, which a
+    consumer thread drains into the sink, so a sink that blocks on a device never holds up the CPU loop. The buffer
+    starts with the sink's latency_frames of silence, which a sink playing to a device in real time uses to ride out
+    scheduling jitter. Every sample produced reaches the sink by the time the audio is closed, unless the sink fell more
+    than the buffer's second behind
+    """
+
+    def __init__(self, sink=None, generator=None, rate=sample_rate, hz=60):
+        self.sink = sink if sink is not None else NullAudioSink()
+        self.generator = generator if generator is not None else Tone(rate=rate)
+        self.rate = rate
+        self.hz = hz
+        self.frames = 0
+        self.buffer = RingBuffer(rate)
+        self.buffer.write(bytes(self.frame_length(0) * 2 * self.sink.latency_frames))
+        self.ready = threading.Event()
+        self.closed = False
+        self.consumer = threading.Thread(target=self.drain, name="audio", daemon=True)
+        self.consumer.start()
+
+    def frame_length(self, frame):
+        """
+        Samples in a frame. Rates that are not a multiple of hz spread the remainder evenly
+        :param frame: frame number
+        :return: int
+        """
+        return (frame + 1) * self.rate // self.hz - frame * self.rate // self.hz
+
+    def frame(self, sounding):
+        """
+        Produce one frame of audio and wake the consumer. Never waits on the sink
+        :param sounding: whether the sound timer was running during the frame
+        :return: None
+        """
+        count = self.frame_length(self.frames)
+        self.buffer.write(self.generator.samples(count) if sounding else bytes(count * 2))
+        self.frames += 1
+        self.ready.set()
+
+    def drain(self):
+        """
+        Consumer thread: pass on whatever is buffered each time a frame arrives, until closed
+        :return: None
+        """
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            if self.closed:
+                return
+            count = len(self.buffer)
+            if count:
+                self.sink.write(self.buffer.read(count))
+
+    def close(self):
+        """
+        Stop the consumer, pass on whatever is still buffered and close the sink
+        :return: None
+        """
+        self.closed = True
+        self.ready.set()
+        self.consumer.join()
+        self.sink.write(self.buffer.read(len(self.buffer)))
+        self.sink.close()
@@ -0,0 +1,374 @@
+import numpy as np
+
+from main import font_set
+
+
+def cpu_state(cpu):
+    """
+    Machine state of a scalar CPU in the layout used by BatchEmulator.lane_state
+    :param cpu: CPU
+    :return: dict
+    """
+    return {
+        "memory": bytes(cpu.memory),
+        "v": bytes(cpu.v),
+        "stack": list(cpu.stack),
+        "gfx": bytes(cpu.gfx),
+        "pc": cpu.pc,
+        "I": cpu.I,
+        "sp": cpu.sp,
+        "delay_timer": cpu.delay_timer,
+        "sound_timer": cpu.sound_timer,
+    }
+
+
+class BatchEmulator:
+    """
+    Runs many CHIP-8 machines in lockstep, with the state of every lane held in NumPy arrays. Each tick executes one
+    instruction on every running lane, grouping lanes by opcode so each instruction kind is applied as one vectorized
+    operation. Semantics match Emulator.run with the table decoder, timers ticking every instructions_per_frame cycles
+    of each lane; a lane that hits an instruction the scalar CPU would fault on is halted before executing it
+    """
+
+    def __init__(self, lanes, seed=None, instructions_per_frame=10):
+        self.lanes = lanes
+        self.instructions_per_frame = instructions_per_frame
+        self.memory = np.zeros((lanes, 4096), dtype=np.uint8)
+        self.v = np.zeros((lanes, 16), dtype=np.uint8)
+        self.stack = np.zeros((lanes, 255), dtype=np.int64)
+        self.keypad = np.zeros((lanes, 16), dtype=np.uint8)
+        self.gfx = np.zeros((lanes, 32, 64), dtype=np.uint8)
+        self.pc = np.full(lanes, 0x200, dtype=np.int64)
+        self.I = np.zeros(lanes, dtype=np.int64)
+        self.sp = np.zeros(lanes, dtype=np.int64)
+        self.delay_timer = np.zeros(lanes, dtype=np.int64)
+        self.sound_timer = np.zeros(lanes, dtype=np.int64)
+        self.draw_flag = np.zeros(lanes, dtype=bool)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.handlers = (self.op_0, self.op_1, self.op_2, self.op_3, self.op_4, self.op_5, self.op_6, self.op_7,
+                         self.op_8, self.op_9, self.op_a, self.op_b, self.op_c, self.op_d, self.op_e, self.op_f)
+
+    def load_font_set(self):
+        """
+        Load the base font set into every lane
+        :return: None
+        """
+        self.memory[:, :len(font_set)] = font_set
+
+    def load_rom(self, rom):
+        """
+        Load the same rom into every lane
+        :param rom: bytes
+        :return: None
+        """
+        if len(rom) > 4096 - 0x200:
+            raise IndexError(f"Memory access error at {0x200 + len(rom) - 1}")
+        self.memory[:, 0x200:0x200 + len(rom)] = np.frombuffer(rom, dtype=np.uint8)
+
+    def lane_state(self, lane):
+        """
+        Machine state of one lane, comparable with cpu_state
+        :param lane: lane index
+        :return: dict
+        """
+        return {
+            "memory": self.memory[lane].tobytes(),
+            "v": self.v[lane].tobytes(),
+            "stack": [int(val) for val in self.stack[lane]],
+            "gfx": np.packbits(self.gfx[lane], axis=-1).tobytes(),
+            "pc": int(self.pc[lane]),
+            "I": int(self.I[lane]),
+            "sp": int(self.sp[lane]),
+            "delay_timer": int(self.delay_timer[lane]),
+            "sound_timer": int(self.sound_timer[lane]),
+        }
+
+    def run(self, cycles):
+        """
+        Execute a number of ticks
+        :param cycles: number of ticks
+        :return: number of lanes still running
+        """
+        for _ in range(cycles):
+            if not self.step():
+                break
+        return int(np.count_nonzero(~self.halted))
+
+    def step(self):
+        """
+        Execute one instruction on every running lane, then tick the timers of the lanes that reached a frame boundary
+        :return: number of lanes that executed an instruction
+        """
+        lanes = np.flatnonzero(~self.halted)
+        if not len(lanes):
+            return 0
+        pc = self.pc[lanes]
+        lanes = self.fault(lanes, (pc < 0) | (pc + 1 >= 4096))
+        pc = self.pc[lanes]
+        op_codes = self.memory[lanes, pc].astype(np.int64) << 8 | self.memory[lanes, pc + 1]
+        self.cycles[lanes] += 1
+        nibbles = op_codes >> 12
+        for nibble in np.unique(nibbles):
+            group = nibbles == nibble
+            self.handlers[nibble](lanes[group], op_codes[group])
+        ticking = lanes[self.cycles[lanes] % self.instructions_per_frame == 0]
+        self.delay_timer[ticking] = np.maximum(self.delay_timer[ticking] - 1, 0)
+        self.sound_timer[ticking] = np.maximum(self.sound_timer[ticking] - 1, 0)
+        return len(lanes)
+
+    def fault(self, lanes, mask):
+        """
+        Halt the lanes where mask is set
+        :param lanes: lane indexes
+        :param mask: bool per lane
+        :return: the lanes that are still running
+        """
+        if mask.any():
+            self.halted[lanes[mask]] = True
+            return lanes[~mask]
+        return lanes
+
+    def reg(self, lanes, idx):
+        """
+        Read a register per lane widened for arithmetic
+        :param lanes: lane indexes
+        :param idx: register index per lane
+        :return: array
+        """
+        return self.v[lanes, idx].astype(np.int64)
+
+    def skip(self, lanes, cond):
+        """
+        Advance past the next instruction where cond holds, otherwise to the next one
+        :param lanes: lane indexes
+        :param cond: bool per lane
+        :return: None
+        """
+        self.pc[lanes] += np.where(cond, 4, 2)
+
+    def op_0(self, lanes, op_codes):
+        """
+        00E0 clears the screen, 00EE returns from a subroutine, 0000 does not advance; anything else faults
+        """
+        self.fault(lanes, ~np.isin(op_codes, (0x0000, 0x00E0, 0x00EE)))
+        clear = lanes[op_codes == 0x00E0]
+        self.gfx[clear] = 0
+        self.pc[clear] += 2
+        self.draw_flag[clear] = True
+
+        ret = lanes[op_codes == 0x00EE]
+        sp = self.sp[ret] - 1
+        ret = self.fault(ret, sp < -255)
+        sp = self.sp[ret] - 1
+        self.sp[ret] = sp
+        self.pc[ret] = self.stack[ret, sp % 255] + 2
+
+    def op_1(self, lanes, op_codes):
+        """
+        1NNN jumps to address NNN
+        """
+        self.pc[lanes] = op_codes & 0x0FFF
+
+    def op_2(self, lanes, op_codes):
+        """
+        2NNN calls subroutine at NNN
+        """
+        sp = self.sp[lanes]
+        keep = (sp >= -255) & (sp < 255)
+        lanes = self.fault(lanes, ~keep)
+        op_codes = op_codes[keep]
+        sp = self.sp[lanes]
+        self.stack[lanes, sp % 255] = self.pc[lanes]
+        self.sp[lanes] = sp + 1
+        self.pc[lanes] = op_codes & 0x0FFF
+
+    def op_3(self, lanes, op_codes):
+        """
+        3XNN skips the next instruction if VX equals NN
+        """
+        self.skip(lanes, self.reg(lanes, (op_codes >> 8) & 0xF) == (op_codes & 0xFF))
+
+    def op_4(self, lanes, op_codes):
+        """
+        4XNN skips the next instruction if VX doesn't equal NN
+        """
+        self.skip(lanes, self.reg(lanes, (op_codes >> 8) & 0xF) != (op_codes & 0xFF))
+
+    def op_5(self, lanes, op_codes):
+        """
+        5XY0 skips the next instruction if VX equals VY
+        """
+        self.skip(lanes, self.reg(lanes, (op_codes >> 8) & 0xF) == self.reg(lanes, (op_codes >> 4) & 0xF))
+
+    def op_6(self, lanes, op_codes):
+        """
+        6XNN sets VX to NN
+        """
+        self.v[lanes, (op_codes >> 8) & 0xF] = op_codes & 0xFF
+        self.pc[lanes] += 2
+
+    def op_7(self, lanes, op_codes):
+        """
+        7XNN adds NN to VX
+        """
+        x = (op_codes >> 8) & 0xF
+        self.v[lanes, x] = (self.reg(lanes, x) + (op_codes & 0xFF)) & 0xFF
+        self.pc[lanes] += 2
+
+    def op_8(self, lanes, op_codes):
+        """
+        8XYN register to register arithmetic
+        """
+        known = np.isin(op_codes & 0xF, (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE))
+        lanes, op_codes = self.fault(lanes, ~known), op_codes[known]
+        n = op_codes & 0xF
+        for kind in np.unique(n):
+            group = n == kind
+            sub = lanes[group]
+            x = (op_codes[group] >> 8) & 0xF
+            y = (op_codes[group] >> 4) & 0xF
+            v_x = self.reg(sub, x)
+            v_y = self.reg(sub, y)
+            match kind:
+                case 0x0:
+                    self.v[sub, x] = v_y
+                case 0x1:
+                    self.v[sub, x] = v_x | v_y
+                case 0x2:
+                    self.v[sub, x] = v_x & v_y
+                case 0x3:
+                    self.v[sub, x] = v_x ^ v_y
+                case 0x4:
+                    total = v_x + v_y
+                    self.v[sub, x] = total & 0xFF
+                    self.v[sub, 0xF] = total > 255
+                case 0x5:
+                    total = v_x - v_y
+                    self.v[sub, x] = total & 0xFF
+                    self.v[sub, 0xF] = total >= 0
+                case 0x6:
+                    self.v[sub, x] = v_x >> 1
+                    self.v[sub, 0xF] = self.v[sub, x] & 0x1
+                case 0x7:
+                    total = v_y - v_x
+                    self.v[sub, x] = total & 0xFF
+                    self.v[sub, 0xF] = total >= 0
+                case 0xE:
+                    self.v[sub, x] = (v_x << 1) & 0xFF
+                    self.v[sub, 0xF] = self.v[sub, x] >> 7
+            self.pc[sub] += 2
+
+    def op_9(self, lanes, op_codes):
+        """
+        9XY0 skips the next instruction if VX doesn't equal VY
+        """
+        self.skip(lanes, self.reg(lanes, (op_codes >> 8) & 0xF) != self.reg(lanes, (op_codes >> 4) & 0xF))
+
+    def op_a(self, lanes, op_codes):
+        """
+        ANNN sets I to the address NNN
+        """
+        self.I[lanes] = op_codes & 0x0FFF
+        self.pc[lanes] += 2
+
+    def op_b(self, lanes, op_codes):
+        """
+        BNNN jumps to the address NNN plus V0
+        """
+        self.pc[lanes] = (op_codes & 0x0FFF) + self.reg(lanes, 0)
+
+    def op_c(self, lanes, op_codes):
+        """
+        CXNN sets VX to a random number and NN
+        """
+        self.v[lanes, (op_codes >> 8) & 0xF] = self.rng.integers(0, 256, size=len(lanes)) & (op_codes & 0xFF)
+        self.pc[lanes] += 2
+
+    def op_d(self, lanes, op_codes):
+        """
+        DXYN draws an N row sprite from I at VX, VY, wrapping at the screen edges
+        """
+        n = op_codes & 0xF
+        keep = (self.I[lanes] >= 0) & ((n == 0) | (self.I[lanes] + n <= 4096))
+        lanes = self.fault(lanes, ~keep)
+        op_codes = op_codes[keep]
+        n = op_codes & 0xF
+        self.v[lanes, 0xF] = 0
+        v_x = self.reg(lanes, (op_codes >> 8) & 0xF)
+        v_y = self.reg(lanes, (op_codes >> 4) & 0xF)
+        collision = np.zeros(len(lanes), dtype=np.uint8)
+        for row in range(int(n.max(initial=0))):
+            drawing = row < n
+            sub = lanes[drawing]
+            sprite = self.memory[sub, self.I[sub] + row]
+            y = (v_y[drawing] + row) % 32
+            for col in range(8):
+                bit = (sprite >> (7 - col)) & 1
+                x = (v_x[drawing] + col) % 64
+                collision[drawing] |= self.gfx[sub, y, x] & bit
+                self.gfx[sub, y, x] ^= bit
+        self.v[lanes, 0xF] = collision
+        self.draw_flag[lanes] = True
+        self.pc[lanes] += 2
+
+    def op_e(self, lanes, op_codes):
+        """
+        EX9E and EXA1 skip on the key stored in VX; anything else faults
+        """
+        nn = op_codes & 0xFF
+        keyed = (nn == 0x9E) | (nn == 0xA1)
+        self.fault(lanes, ~keyed)
+        lanes, nn, x = lanes[keyed], nn[keyed], (op_codes[keyed] >> 8) & 0xF
+        key = self.reg(lanes, x)
+        lanes = self.fault(lanes, key >= 16)
+        nn, key = nn[key < 16], key[key < 16]
+        pressed = self.keypad[lanes, key] != 0
+        self.skip(lanes, np.where(nn == 0x9E, pressed, ~pressed))
+
+    def op_f(self, lanes, op_codes):
+        """
+        FXNN timers, keypad wait, I arithmetic and memory transfers; anything else faults
+        """
+        nn = op_codes & 0xFF
+        for kind in np.unique(nn):
+            group = nn == kind
+            sub = lanes[group]
+            x = (op_codes[group] >> 8) & 0xF
+            match kind:
+                case 0x07:
+                    self.v[sub, x] = self.delay_timer[sub] & 0xFF
+                case 0x0A:
+                    pressed = self.keypad[sub] != 0
+                    ready = pressed.any(axis=1)
+                    sub, x = sub[ready], x[ready]
+                    self.v[sub, x] = 15 - np.argmax(pressed[ready, ::-1], axis=1)
+                case 0x15:
+                    self.delay_timer[sub] = self.reg(sub, x)
+                case 0x18:
+                    self.sound_timer[sub] = self.reg(sub, x)
+                case 0x1E:
+                    self.I[sub] += self.reg(sub, x)
+                case 0x29:
+                    self.I[sub] = self.reg(sub, x) * 5
+                case 0x33:
+                    keep = (self.I[sub] >= 0) & (self.I[sub] + 2 < 4096)
+                    sub, x = self.fault(sub, ~keep), x[keep]
+                    val = self.reg(sub, x)
+                    self.memory[sub, self.I[sub]] = val // 100
+                    self.memory[sub, self.I[sub] + 1] = val // 10 % 10
+                    self.memory[sub, self.I[sub] + 2] = val % 10
+                case 0x55 | 0x65:
+                    keep = (self.I[sub] >= 0) & (self.I[sub] + x < 4096)
+                    sub, x = self.fault(sub, ~keep), x[keep]
+                    for reg in range(int(x.max(initial=-1)) + 1):
+                        moving = sub[reg <= x]
+                        if kind == 0x55:
+                            self.memory[moving, self.I[moving] + reg] = self.v[moving, reg]
+                        else:
+                            self.v[moving, reg] = self.memory[moving, self.I[moving] + reg]
+                case _:
+                    self.halted[sub] = True
+                    continue
+            self.pc[sub] += 2
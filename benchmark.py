@@ -0,0 +1,139 @@
+import argparse
+import json
+import sys
+import tracemalloc
+from time import perf_counter
+
+from display import FramebufferDisplay
+from main import Emulator, decoders
+
+
+def assemble(op_codes):
+    """
+    Pack a list of opcodes into rom bytes
+    :param op_codes: list of 16 bit instructions
+    :return: bytes
+    """
+    return b"".join(op_code.to_bytes(2, "big") for op_code in op_codes)
+
+
+def synthetic_roms():
+    """
+    Corpus of small roms, each looping forever on one kind of work
+    :return: dict of name to rom bytes
+    """
+    calls = [0x2210, 0x7001, 0x1200, 0x0000, 0x0000, 0x0000, 0x0000, 0x0000]
+    for depth in range(8):
+        calls += [0x2214 + depth * 4, 0x00EE]
+    calls[-2] = 0x8014
+    return {
+        # register arithmetic with a conditional skip and a backwards jump
+        "alu": assemble([0x6000, 0x6101, 0x8014, 0x8AB4, 0x7101, 0x8A06, 0x8BA5, 0x8C17, 0x8A0E, 0x4005, 0x6000,
+                         0x1204]),
+        # sprites walking across the screen, most of them wrapping
+        "sprites": assemble([0x6000, 0x6100, 0x6200, 0xF229, 0xD015, 0xD105, 0x7003, 0x7102, 0x7201, 0x620F,
+                             0xD01F, 0x1206]),
+        # nested subroutine calls eight deep
+        "calls": assemble(calls),
+        # BCD conversion and register block moves
+        "memory": assemble([0x6000, 0xA300, 0xF033, 0xFF55, 0xA310, 0xFF65, 0x7007, 0xF01E, 0xF565, 0x1202]),
+        # clear the screen between every draw
+        "clears": assemble([0x6000, 0xF029, 0x00E0, 0xD005, 0x7001, 0x00E0, 0x1204]),
+    }
+
+
+def measure(rom, decoder, cycles):
+    """
+    Run one rom headless on one engine for a fixed cycle budget
+    :param rom: rom bytes
+    :param decoder: engine
+    :param cycles: cycle budget
+    :return: dict with ips, fps, startup seconds and peak bytes
+    """
+    started = perf_counter()
+    display = FramebufferDisplay()
+    emu = Emulator(decoder, display, seed=0)
+    emu.load_font_set()
+    emu.load_rom_data(rom)
+    emu.run(cycles=1)
+    startup = perf_counter() - started
+
+    started = perf_counter()
+    emu.run(cycles=cycles)
+    elapsed = perf_counter() - started
+
+    tracemalloc.start()
+    probe = Emulator(decoder, FramebufferDisplay(), seed=0)
+    probe.load_font_set()
+    probe.load_rom_data(rom)
+    probe.run(cycles=min(cycles, 2000))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "ips": cycles / elapsed,
+        "fps": display.frames / elapsed,
+        "startup": startup,
+        "peak_bytes": peak,
+    }
+
+
+def run_suite(cycles=100000, engines=decoders, roms=None):
+    """
+    Measure every rom in the corpus on every engine
+    :param cycles: cycle budget per run
+    :param engines: decoders to measure
+    :param roms: dict of name to rom bytes, defaults to the synthetic corpus
+    :return: dict of "rom/engine" to measurements
+    """
+    roms = roms if roms is not None else synthetic_roms()
+    return {f"{name}/{engine}": measure(rom, engine, cycles) for name, rom in roms.items() for engine in engines}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Find runs whose instructions per second fell more than tolerance below the baseline
+    :param results: output of run_suite
+    :param baseline: earlier output of run_suite
+    :param tolerance: allowed fractional slowdown
+    :return: list of (key, baseline ips, current ips)
+    """
+    regressions = []
+    for key, expected in baseline.items():
+        current = results.get(key)
+        if current is not None and current["ips"] < expected["ips"] * (1 - tolerance):
+            regressions.append((key, expected["ips"], current["ips"]))
+    return regressions
+
+
+def main():
+    """
+    Run the benchmark suite, optionally saving a baseline or failing on a regression against one
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Chip-8 engines on a synthetic rom corpus")
+    parser.add_argument("--cycles", type=int, default=100000, help="cycle budget per run")
+    parser.add_argument("--engines", nargs="*", default=list(decoders), help="decoders to measure")
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional slowdown")
+    args = parser.parse_args()
+
+    results = run_suite(args.cycles, args.engines)
+    print(f"{'run':<16} {'ips':>12} {'fps':>10} {'startup ms':>11} {'peak KB':>8}")
+    for key, result in results.items():
+        print(f"{key:<16} {result['ips']:>12,.0f} {result['fps']:>10,.0f} {result['startup'] * 1000:>11.2f} "
+              f"{result['peak_bytes'] / 1024:>8.1f}")
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for key, expected, current in regressions:
+            print(f"REGRESSION {key}: {current:,.0f} ips against a baseline of {expected:,.0f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
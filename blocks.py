@@ -0,0 +1,172 @@
+from quirks import profiles
+
+max_block_length = 64
+
+
+def translate_opcode(op_code, quirks=None):
+    """
+    Python source for a straight line instruction, or None if the instruction ends a block. The generated lines behave
+    exactly like the matching handler in main.compile_opcode for the same quirks profile
+    :param op_code: 16 bit instruction
+    :param quirks: Quirks, the default profile when None
+    :return: list of source lines or None
+    """
+    if quirks is None:
+        quirks = profiles["default"]
+    legacy = quirks is profiles["default"]
+    x = (op_code & 0x0F00) >> 8
+    y = (op_code & 0x00F0) >> 4
+    nn = op_code & 0x00FF
+    nnn = op_code & 0x0FFF
+    match op_code & 0xF000:
+        case 0x6000:  # 6XNN
+            return [f"v[{x}] = {nn}"]
+        case 0x7000:  # 7XNN
+            return [f"v[{x}] = (v[{x}] + {nn}) & 0xFF"]
+        case 0x8000:  # 8XYN
+            match op_code & 0x000F:
+                case 0x0:
+                    return [f"v[{x}] = v[{y}]"]
+                case 0x1 | 0x2 | 0x3 if quirks.vf_reset:
+                    return [f"v[{x}] {'|&^'[(op_code & 0x000F) - 1]}= v[{y}]", "v[15] = 0"]
+                case 0x1:
+                    return [f"v[{x}] |= v[{y}]"]
+                case 0x2:
+                    return [f"v[{x}] &= v[{y}]"]
+                case 0x3:
+                    return [f"v[{x}] ^= v[{y}]"]
+                case 0x4:
+                    return [f"t = v[{x}] + v[{y}]", f"v[{x}] = t & 0xFF", "v[15] = 1 if t > 255 else 0"]
+                case 0x5:
+                    return [f"t = v[{x}] - v[{y}]", f"v[{x}] = t & 0xFF", "v[15] = 0 if t < 0 else 1"]
+                case 0x6 if not legacy:
+                    return [f"t = v[{y if quirks.shift_vy else x}]", f"v[{x}] = t >> 1", "v[15] = t & 0x1"]
+                case 0x6:
+                    return [f"v[{x}] >>= 1", f"v[15] = v[{x}] & 0x1"]
+                case 0x7:
+                    return [f"t = v[{y}] - v[{x}]", f"v[{x}] = t & 0xFF", "v[15] = 0 if t < 0 else 1"]
+                case 0xE if not legacy:
+                    return [f"t = v[{y if quirks.shift_vy else x}]", f"v[{x}] = (t << 1) & 0xFF", "v[15] = t >> 7"]
+                case 0xE:
+                    return [f"v[{x}] = (v[{x}] << 1) & 0xFF", f"v[15] = v[{x}] >> 7"]
+        case 0xA000:  # ANNN
+            return [f"cpu.I = {nnn}"]
+        case 0xC000:  # CXNN
+            return [f"v[{x}] = cpu.rng.randint(0, 255) & {nn}"]
+        case 0xF000:
+            match nn:
+                case 0x07:  # FX07
+                    return [f"v[{x}] = cpu.delay_timer & 0xFF"]
+                case 0x15:  # FX15
+                    return [f"cpu.delay_timer = v[{x}]"]
+                case 0x18:  # FX18
+                    return [f"cpu.sound_timer = v[{x}]"]
+                case 0x1E:  # FX1E
+                    return [f"cpu.I += v[{x}]"]
+                case 0x29:  # FX29
+                    return [f"cpu.I = v[{x}] * 5"]
+                case 0x65:  # FX65
+                    lines = ["i = cpu.I"] + [f"v[{reg}] = memory[i + {reg}] & 0xFF" for reg in range(x + 1)]
+                    return lines + [f"cpu.I = i + {x + 1}"] if quirks.load_store_increment else lines
+    return None
+
+
+class BlockCache:
+    """
+    Translates straight line runs of instructions into single Python functions, cached by start address. A block runs
+    up to and including the next jump, call, skip, draw or memory write, which is executed through the opcode table
+    """
+
+    def __init__(self, opcode_table, quirks=None):
+        self.opcode_table = opcode_table
+        self.quirks = quirks
+        self.blocks = {}
+        self.owners = {}
+        self.extents = {}
+
+    def execute(self, cpu):
+        """
+        Run the block starting at the program counter, translating it first if needed. A block that would run past
+        cpu.horizon, the end of the current run, is replaced by a single instruction, as is a block that reads or
+        writes a timer and would run past cpu.timer_horizon, the next timer tick
+        :param cpu: CPU
+        :return: number of instructions executed
+        """
+        block = self.blocks.get(cpu.pc)
+        if block is None:
+            block = self.translate(cpu.memory, cpu.pc)
+        if cpu.cycles + block[1] > (cpu.timer_horizon if block[2] else cpu.horizon):
+            memory = cpu.memory
+            self.opcode_table[memory[cpu.pc] << 8 | memory[cpu.pc + 1]](cpu)
+            return 1
+        block[0](cpu)
+        return block[3]
+
+    def translate(self, memory, start):
+        """
+        Translate and cache the block starting at a given address, or return the one already cached there
+        :param memory: machine memory
+        :param start: address of the first instruction
+        :return: (function, instruction count, whether the block uses the timers, cycles left for the caller to count)
+        """
+        block = self.blocks.get(start)
+        if block is not None:
+            return block
+        lines = []
+        timed = False
+        terminator = None
+        pc = start
+        length = 0
+        while length < max_block_length and pc + 1 < len(memory):
+            op_code = memory[pc] << 8 | memory[pc + 1]
+            source = translate_opcode(op_code, self.quirks)
+            length += 1
+            if source is None:
+                terminator = self.opcode_table[op_code]
+                break
+            lines += source
+            timed = timed or op_code & 0xF0FF in (0xF007, 0xF015, 0xF018)
+            pc += 2
+        if not length:
+            raise IndexError(f"Memory access error at {start}")
+
+        if not lines and terminator is not None:
+            block = (terminator, 1, False, 1)
+        else:
+            body = "\n    ".join(["v = cpu.v", "memory = cpu.memory"] + lines + [f"cpu.pc = {pc}"])
+            if terminator is not None:
+                # the terminator sees the cycle count of its own instruction, as it would in the interpreter
+                body += f"\n    cpu.cycles += {length - 1}\n    terminator(cpu)"
+            namespace = {"terminator": terminator}
+            exec(f"def block(cpu):\n    {body}\n", namespace)
+            block = (namespace["block"], length, timed, 1 if terminator is not None else length)
+
+        self.blocks[start] = block
+        extent = self.extents[start] = range(start, pc + 2 if terminator is not None else pc)
+        for loc in extent:
+            self.owners.setdefault(loc, []).append(start)
+        return block
+
+    def invalidate(self, loc):
+        """
+        Drop every block covering a memory location that is about to change
+        :param loc: memory location
+        :return: None
+        """
+        for start in list(self.owners.get(loc, ())):
+            del self.blocks[start]
+            # forget the block at every address it covered, not just this one
+            for covered in self.extents.pop(start):
+                owners = self.owners[covered]
+                owners.remove(start)
+                if not owners:
+                    del self.owners[covered]
+
+    def clear(self):
+        """
+        Drop every translated block
+        :return: None
+        """
+        self.blocks.clear()
+        self.owners.clear()
+        self.extents.clear()
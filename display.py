@@ -0,0 +1,136 @@
+scalar = 15
+
+
+def frame_shape(frame):
+    """
+    Screen size of a frame, 64x32 or the 128x64 of the extended quirks profiles
+    :param frame: graphics memory
+    :return: (width, height)
+    """
+    return (64, 32) if len(frame) == 256 else (128, 64)
+
+
+def dirty_spans(previous, frame):
+    """
+    Find the pixels that changed between two frames, merged into horizontal spans of the same colour
+    :param previous: last presented graphics memory, width / 8 bytes per row
+    :param frame: new graphics memory, width / 8 bytes per row
+    :return: list of (y, start x, end x, value)
+    """
+    width, height = frame_shape(frame)
+    row_bytes = width >> 3
+    spans = []
+    for y in range(height):
+        base = y * row_bytes
+        row = int.from_bytes(frame[base:base + row_bytes], "big")
+        changed = row ^ int.from_bytes(previous[base:base + row_bytes], "big")
+        if not changed:
+            continue
+        x = 0
+        while x < width:
+            bit = width - 1 - x
+            if not (changed >> bit) & 1:
+                x += 1
+                continue
+            start = x
+            val = (row >> bit) & 1
+            while x < width and (changed >> (width - 1 - x)) & 1 and (row >> (width - 1 - x)) & 1 == val:
+                x += 1
+            spans.append((y, start, x, val))
+    return spans
+
+
+class NullDisplay:
+    """
+    Display sink that discards every frame, for headless runs
+    """
+
+    def draw(self, gfx):
+        """
+        Present a frame
+        :param gfx: graphics memory
+        :return: None
+        """
+
+    def is_open(self):
+        """
+        Whether the display still wants frames
+        :return: bool
+        """
+        return True
+
+    def close(self):
+        """
+        Release the display
+        :return: None
+        """
+
+
+class FramebufferDisplay(NullDisplay):
+    """
+    Display sink that keeps a copy of the last presented frame in memory
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.frames = 0
+
+    def draw(self, gfx):
+        """
+        Keep a copy of the frame
+        :param gfx: graphics memory
+        :return: None
+        """
+        self.frame = bytes(gfx)
+        self.frames += 1
+
+
+class EasyGraphicsDisplay(NullDisplay):
+    """
+    Display sink that renders into an easygraphics window, redrawing only the pixels that changed since the last frame
+    """
+
+    def __init__(self, caption="Chip-8 Emulator"):
+        import easygraphics
+        self.graphics = easygraphics
+        self.previous = None
+        easygraphics.init_graph(64 * scalar, 32 * scalar)
+        easygraphics.set_render_mode(easygraphics.RenderMode.RENDER_MANUAL)
+        easygraphics.set_caption(caption)
+
+    def draw(self, gfx):
+        """
+        Draw the screen
+        :param gfx: graphics memory
+        :return: None
+        """
+        frame = bytes(gfx)
+        if frame == self.previous:
+            return
+        graphics = self.graphics
+        colours = (graphics.Color.RED, graphics.Color.BLUE)
+        # the window keeps its size, high resolution frames use pixels of half the size
+        size = scalar * 64 / frame_shape(frame)[0]
+        if self.previous is None or len(self.previous) != len(frame) or not any(frame):
+            graphics.set_fill_color(colours[0])
+            graphics.draw_rect(0, 0, 64 * scalar, 32 * scalar)
+            self.previous = bytes(len(frame))
+        for y, start, end, val in dirty_spans(self.previous, frame):
+            graphics.set_fill_color(colours[val])
+            graphics.draw_rect(start * size, y * size, end * size, (y + 1) * size)
+        self.previous = frame
+        graphics.delay_fps(1000)
+
+    def is_open(self):
+        """
+        Whether the window is still open
+        :return: bool
+        """
+        return self.graphics.is_run()
+
+    def close(self):
+        """
+        Close the window
+        :return: None
+        """
+        self.graphics.close_graph()
@@ -0,0 +1,348 @@
+import argparse
+import os
+import struct
+import zlib
+
+from display import NullDisplay, frame_shape
+from savestate import xor_bytes
+
+magic = b"CH8V"
+version = 1
+file_header = struct.Struct("<4sHBB")
+chunk_size = 1 << 16
+
+
+class FrameStreamWriter(NullDisplay):
+    """
+    Streams frames to a file as XOR deltas against the previous frame, all fed through one zlib stream so that
+    unchanged regions cost next to nothing. Frames identical to the last one written are dropped. Each record is a
+    varint frame number delta followed by the frame sized delta, so only the last frame is ever held in memory. Works
+    as a display sink, numbering frames by draw call unless a clock returning the current frame number is given. The
+    screen size is taken from the first frame unless given, and every later frame must match it
+    """
+
+    def __init__(self, path, clock=None, level=6, width=None, height=None):
+        self.file = open(path, "wb")
+        self.compressor = zlib.compressobj(level)
+        self.clock = clock
+        self.previous = None
+        if width is not None:
+            self.start(width, height)
+        self.last_frame = 0
+        self.draws = 0
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self, width, height):
+        """
+        Write the file header, fixing the screen size of the stream
+        :param width: 64 or 128
+        :param height: 32 or 64
+        :return: None
+        """
+        if (width, height) not in ((64, 32), (128, 64)):
+            raise ValueError(f"Unsupported screen size {width}x{height}")
+        self.file.write(file_header.pack(magic, version, width, height))
+        self.previous = bytes(width * height // 8)
+
+    def write(self, gfx, frame):
+        """
+        Append a frame unless it matches the last one written
+        :param gfx: graphics memory or any buffer of the stream's frame size
+        :param frame: frame number, not less than the last one written
+        :return: bool, whether the frame was written
+        """
+        current = bytes(gfx)
+        if self.previous is None:
+            if len(current) not in (256, 1024):
+                raise ValueError(f"Expected a 256 or 1024 byte frame, got {len(current)}")
+            self.start(*frame_shape(current))
+        elif len(current) != len(self.previous):
+            raise ValueError(f"Expected a {len(self.previous)} byte frame, got {len(current)}")
+        if current == self.previous:
+            return False
+        delta = frame - self.last_frame
+        if delta < 0:
+            raise ValueError(f"Frame {frame} is before frame {self.last_frame}")
+        record = bytearray()
+        while delta >= 0x80:
+            record.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        record.append(delta)
+        record += xor_bytes(current, self.previous)
+        data = self.compressor.compress(record)
+        if data:
+            self.file.write(data)
+        self.previous = current
+        self.last_frame = frame
+        self.written += 1
+        return True
+
+    def draw(self, gfx):
+        """
+        Write a frame
+        :param gfx: graphics memory
+        :return: None
+        """
+        self.write(gfx, self.clock() if self.clock is not None else self.draws)
+        self.draws += 1
+
+    def close(self):
+        """
+        Flush the compressed stream and close the file. A stream that never got a frame is written as 64x32
+        :return: None
+        """
+        if not self.file.closed:
+            if self.previous is None:
+                self.start(64, 32)
+            self.file.write(self.compressor.flush())
+            self.file.close()
+
+
+def record_frames(emu, path, frames):
+    """
+    Run an emulator headless for a number of 60 Hz frames, streaming the screen at the end of every frame
+    :param emu: Emulator
+    :param path: output file
+    :param frames: number of frames to run
+    :return: number of frames written
+    """
+    cpu = emu.cpu
+    with FrameStreamWriter(path, width=cpu.width, height=cpu.height) as writer:
+        for frame in range(frames):
+            emu.run(cycles=emu.next_tick() - cpu.cycles, render=False)
+            if cpu.draw_flag:
+                cpu.draw_flag = False
+                writer.write(cpu.gfx, frame)
+        return writer.written
+
+
+def read_frames(path):
+    """
+    Decode a frame stream incrementally
+    :param path: file written by FrameStreamWriter
+    :return: iterator of (frame number, frame bytes)
+    """
+    with open(path, "rb") as file:
+        header = file.read(file_header.size)
+        if len(header) < file_header.size:
+            raise ValueError("Not a frame stream")
+        file_magic, file_version, width, height = file_header.unpack(header)
+        if file_magic != magic:
+            raise ValueError("Not a frame stream")
+        if file_version != version or (width, height) not in ((64, 32), (128, 64)):
+            raise ValueError(f"Unsupported frame stream version {file_version} at {width}x{height}")
+        frame_size = width * height // 8
+        frame = bytes(frame_size)
+        number = 0
+        buffer = b""
+        for piece in _inflate(file):
+            buffer += piece
+            pos = 0
+            while True:
+                delta = shift = 0
+                end = pos
+                while end < len(buffer) and buffer[end] & 0x80:
+                    delta |= (buffer[end] & 0x7F) << shift
+                    shift += 7
+                    end += 1
+                if end + 1 + frame_size > len(buffer):
+                    break
+                delta |= buffer[end] << shift
+                number += delta
+                frame = xor_bytes(buffer[end + 1:end + 1 + frame_size], frame)
+                yield number, frame
+                pos = end + 1 + frame_size
+            buffer = buffer[pos:]
+        if buffer:
+            raise ValueError("Truncated frame stream")
+
+
+def _inflate(file):
+    """
+    Decompress the rest of a file holding one zlib stream, never producing more than chunk_size bytes at a time so a
+    highly compressed stream can not blow up in memory
+    :param file: open file positioned at the stream
+    :return: iterator of bytes
+    """
+    decompressor = zlib.decompressobj()
+    data = b""
+    while True:
+        if not data:
+            data = file.read(chunk_size)
+            if not data:
+                break
+        piece = decompressor.decompress(data, chunk_size)
+        data = decompressor.unconsumed_tail
+        if piece:
+            yield piece
+    while piece := decompressor.decompress(b"", chunk_size):
+        yield piece
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise ValueError("Truncated frame stream")
+
+
+def scale_rows(frame, scale):
+    """
+    Split a frame into rows of packed 1 bit pixels, enlarged by a whole number factor
+    :param frame: frame bytes
+    :param scale: pixel size
+    :return: list of bytes, one per output row
+    """
+    width, height = frame_shape(frame)
+    row_bytes = width >> 3
+    rows = []
+    for y in range(height):
+        bits = format(int.from_bytes(frame[y * row_bytes:(y + 1) * row_bytes], "big"), f"0{width}b")
+        row = int("".join(bit * scale for bit in bits), 2).to_bytes(row_bytes * scale, "big")
+        rows += [row] * scale
+    return rows
+
+
+def png_bytes(frame, scale=1):
+    """
+    Encode a frame as a 1 bit greyscale PNG
+    :param frame: frame bytes
+    :param scale: pixel size
+    :return: bytes
+    """
+    width, height = frame_shape(frame)
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width * scale, height * scale, 1, 0, 0, 0, 0)
+    data = b"".join(b"\x00" + row for row in scale_rows(frame, scale))
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(data)) + chunk(b"IEND", b"")
+
+
+def lzw_encode(pixels, min_code_size=2):
+    """
+    GIF flavoured LZW compression with variable code widths, resetting the table when it fills
+    :param pixels: bytes of palette indices
+    :param min_code_size: initial code width minus one
+    :return: bytes
+    """
+    clear = 1 << min_code_size
+    out = bytearray()
+    acc = bits = 0
+    code_size = min_code_size + 1
+    table = {}
+    next_code = clear + 2
+
+    def emit(code):
+        nonlocal acc, bits
+        acc |= code << bits
+        bits += code_size
+        while bits >= 8:
+            out.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+
+    emit(clear)
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key = (prefix, pixel)
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        table[key] = next_code
+        next_code += 1
+        if next_code > 1 << code_size and code_size < 12:
+            code_size += 1
+        elif next_code == 4096:
+            emit(clear)
+            table.clear()
+            code_size = min_code_size + 1
+            next_code = clear + 2
+        prefix = pixel
+    emit(prefix)
+    emit(clear + 1)
+    if bits:
+        out.append(acc & 0xFF)
+    return bytes(out)
+
+
+def write_gif(frames, path, scale=4, hz=60):
+    """
+    Write frames as a looping two colour GIF animation. Each frame is shown until the next one's frame number
+    :param frames: iterable of (frame number, frame bytes), all the same size
+    :param path: output file
+    :param scale: pixel size
+    :param hz: frame numbers per second
+    :return: number of frames written
+    """
+    count = elapsed = 0
+    with open(path, "wb") as file:
+        first = pending = None
+        for number, frame in frames:
+            if pending is None:
+                width, height = frame_shape(frame)
+                file.write(b"GIF89a" + struct.pack("<HHBBB", width * scale, height * scale, 0x80, 0, 0))
+                file.write(b"\x00\x00\x00\xff\xff\xff\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+                first = number
+            else:
+                # delays are whole centiseconds, so round the running total rather than each frame
+                delay = max(round((number - first) * 100 / hz) - elapsed, 1)
+                _write_gif_frame(file, pending, delay, scale)
+                elapsed += delay
+                count += 1
+            pending = frame
+        if pending is None:
+            raise ValueError("No frames to write")
+        _write_gif_frame(file, pending, max(round(100 / hz), 1), scale)
+        count += 1
+        file.write(b"\x3b")
+    return count
+
+
+def _write_gif_frame(file, frame, delay, scale):
+    """
+    Write one GIF image with its graphic control block
+    :param file: open GIF file
+    :param frame: frame bytes
+    :param delay: display time in centiseconds
+    :param scale: pixel size
+    :return: None
+    """
+    pixels = "".join(format(int.from_bytes(row, "big"), f"0{len(row) * 8}b") for row in scale_rows(frame, scale))
+    data = lzw_encode(pixels.encode("ascii").translate(bytes.maketrans(b"01", b"\x00\x01")))
+    file.write(b"\x21\xf9\x04\x00" + struct.pack("<H", delay) + b"\x00\x00")
+    width, height = frame_shape(frame)
+    file.write(b"\x2c" + struct.pack("<HHHHB", 0, 0, width * scale, height * scale, 0) + b"\x02")
+    for pos in range(0, len(data), 255):
+        block = data[pos:pos + 255]
+        file.write(bytes([len(block)]) + block)
+    file.write(b"\x00")
+
+
+def main():
+    """
+    Decode a frame stream into numbered PNG files or a GIF animation
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Decode a Chip-8 frame stream")
+    parser.add_argument("stream", help="frame stream file")
+    parser.add_argument("--png", help="directory to write one PNG per frame into")
+    parser.add_argument("--gif", help="GIF file to write")
+    parser.add_argument("--scale", type=int, default=4, help="pixel size")
+    args = parser.parse_args()
+
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
+        for number, frame in read_frames(args.stream):
+            with open(os.path.join(args.png, f"frame{number:06d}.png"), "wb") as file:
+                file.write(png_bytes(frame, args.scale))
+    if args.gif:
+        write_gif(read_frames(args.stream), args.gif, args.scale)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import struct
+
+magic = b"CH8I"
+version = 2
+# magic, version and the length of the seed, which follows as a signed little endian integer
+file_header = struct.Struct("<4sHH")
+
+
+class InputLog:
+    """
+    Key events keyed by the CPU cycle before which they take effect. Together with the emulator seed this is enough to
+    reproduce a session exactly
+    """
+
+    def __init__(self, events=(), seed=None):
+        # stable by cycle, so a press and release logged on the same cycle keep their order
+        self.events = sorted(events, key=lambda event: event[0])
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.events)
+
+    def __eq__(self, other):
+        return isinstance(other, InputLog) and self.events == other.events and self.seed == other.seed
+
+    def record(self, emu, key, pressed):
+        """
+        Press or release a key now and log it against the current cycle
+        :param emu: Emulator
+        :param key: key index 0-F
+        :param pressed: bool
+        :return: None
+        """
+        self.events.append((emu.cpu.cycles, key, bool(pressed)))
+        emu.set_key(key, pressed)
+
+    def play(self, emu, cycles):
+        """
+        Run an emulator for a number of cycles, applying every logged event that falls inside the run at its cycle
+        :param emu: Emulator
+        :param cycles: number of instructions to execute
+        :return: total cycles executed
+        """
+        cpu = emu.cpu
+        end = cpu.cycles + cycles
+        for cycle, key, pressed in self.events:
+            if cycle < cpu.cycles:
+                continue
+            if cycle >= end:
+                break
+            if cycle > cpu.cycles:
+                emu.run(cycles=cycle - cpu.cycles)
+            emu.set_key(key, pressed)
+        if end > cpu.cycles:
+            emu.run(cycles=end - cpu.cycles)
+        return cpu.cycles
+
+    def to_bytes(self):
+        """
+        Compact encoding: per event a varint cycle delta followed by one byte holding the key and the pressed bit
+        :return: bytes
+        """
+        out = bytearray()
+        last = 0
+        for cycle, key, pressed in self.events:
+            delta = cycle - last
+            last = cycle
+            while delta >= 0x80:
+                out.append(delta & 0x7F | 0x80)
+                delta >>= 7
+            out.append(delta)
+            out.append(key | (0x10 if pressed else 0))
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data, seed=None):
+        """
+        Decode events written by to_bytes
+        :param data: bytes
+        :param seed: emulator seed of the session
+        :return: InputLog
+        """
+        events = []
+        cycle = 0
+        pos = 0
+        while pos < len(data):
+            delta = shift = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                delta |= (byte & 0x7F) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            cycle += delta
+            events.append((cycle, data[pos] & 0xF, bool(data[pos] & 0x10)))
+            pos += 1
+        return cls(events, seed)
+
+    def save(self, path):
+        """
+        Write the log to a file. Only a log with an integer seed can be saved, as without one it can not be replayed
+        :param path: file to write
+        :return: None
+        """
+        if not isinstance(self.seed, int):
+            raise ValueError(f"Can not save an input log with seed {self.seed!r}, it needs an integer seed to replay")
+        size = self.seed.bit_length() // 8 + 1
+        if size > 0xFFFF:
+            raise ValueError("Seed is too large to save")
+        with open(path, "wb") as file:
+            file.write(file_header.pack(magic, version, size))
+            file.write(self.seed.to_bytes(size, "little", signed=True))
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a log written by save
+        :param path: file to read
+        :return: InputLog
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        found, found_version, size = file_header.unpack_from(data)
+        if found != magic or found_version != version:
+            raise ValueError(f"{path} is not a version {version} input log")
+        start = file_header.size + size
+        return cls.from_bytes(data[start:], int.from_bytes(data[file_header.size:start], "little", signed=True))
@@ -1,7 +1,12 @@
+import logging
+import struct
 from math import floor
-from random import randint
+from random import Random
 from sys import argv
-from easygraphics import *
+
+from display import NullDisplay, EasyGraphicsDisplay
+from quirks import get_profile, profiles
+from scheduler import FrameScheduler
 
 font_set = [
     0xF0, 0x90, 0x90, 0x90, 0xF0,  # 0
@@ -22,7 +27,55 @@ font_set = [
     0xF0, 0x80, 0xF0, 0x80, 0x80  # F
 ]
 
-scalar = 15
+# 8x10 digits used by FX30 on the extended profiles, stored right after the small font
+big_font_address = 0x50
+big_font_set = [
+    0x3C, 0x7E, 0xE7, 0xC3, 0xC3, 0xC3, 0xC3, 0xE7, 0x7E, 0x3C,  # 0
+    0x18, 0x38, 0x58, 0x18, 0x18, 0x18, 0x18, 0x18, 0x18, 0x3C,  # 1
+    0x3E, 0x7F, 0xC3, 0x06, 0x0C, 0x18, 0x30, 0x60, 0xFF, 0xFF,  # 2
+    0x3C, 0x7E, 0xC3, 0x03, 0x0E, 0x0E, 0x03, 0xC3, 0x7E, 0x3C,  # 3
+    0x06, 0x0E, 0x1E, 0x36, 0x66, 0xC6, 0xFF, 0xFF, 0x06, 0x06,  # 4
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFE, 0x03, 0xC3, 0x7E, 0x3C,  # 5
+    0x3E, 0x7C, 0xC0, 0xC0, 0xFC, 0xFE, 0xC3, 0xC3, 0x7E, 0x3C,  # 6
+    0xFF, 0xFF, 0x03, 0x06, 0x0C, 0x18, 0x30, 0x60, 0x60, 0x60,  # 7
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7E, 0x7E, 0xC3, 0xC3, 0x7E, 0x3C,  # 8
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7F, 0x3F, 0x03, 0x03, 0x3E, 0x7C,  # 9
+    0x3C, 0x7E, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3, 0xC3,  # A
+    0xFC, 0xFE, 0xC3, 0xC3, 0xFE, 0xFE, 0xC3, 0xC3, 0xFE, 0xFC,  # B
+    0x3C, 0x7E, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0x7E, 0x3C,  # C
+    0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC,  # D
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # E
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xC0, 0xC0  # F
+]
+
+decoders = ("match", "table", "block")
+
+log = logging.getLogger(__name__)
+
+# quirks profile name, cycle count, pc, I, sp, delay timer, sound timer, draw flag, followed by memory, registers,
+# stack, graphics, keypad and the random generator. The extended profiles have 1024 bytes of graphics and add the high
+# resolution flag and the 16 RPL flags at the end
+state_header = struct.Struct("<16sqiiiii?")
+# Mersenne Twister words and position, then whether a spare gaussian is held and its value
+rng_state = struct.Struct("<625I?d")
+state_size = state_header.size + 4096 + 16 + 255 * 2 + 256 + 16 + rng_state.size
+extended_state_size = state_size + 1024 - 256 + 1 + 16
+# programs load at 0x200 and may fill the rest of memory
+max_rom_size = 4096 - 0x200
+
+
+class IllegalInstruction(Exception):
+    """
+    Raised when the machine reaches an instruction it can not execute. The program counter is left on it
+    """
+
+    def __init__(self, op_code, pc):
+        super().__init__(op_code, pc)
+        self.op_code = op_code
+        self.pc = pc
+
+    def __str__(self):
+        return f"Unknown opcode {self.op_code:#06x} at {self.pc:#05x}"
 
 
 class Emulator:
@@ -30,9 +83,12 @@ class Emulator:
     Base class that controls the almost physical functions of stop, start, loading a rom, key presses, etc
     """
 
-    def __init__(self):
-        self.cpu = CPU()
+    __slots__ = ("cpu", "rom", "instructions_per_frame")
+
+    def __init__(self, decoder="table", display=None, instructions_per_frame=10, seed=None, quirks="default"):
+        self.cpu = CPU(decoder, display, Random(seed), quirks)
         self.rom = False
+        self.instructions_per_frame = instructions_per_frame
 
     def start(self):
         """
@@ -43,50 +99,144 @@ class Emulator:
             print("Please load a rom")
         else:
             self.load_font_set()
-            self.cpu.start()
+            FrameScheduler(self).run()
+
+    def run(self, cycles=None, until=None, render=True):
+        """
+        Run without a window until a number of cycles have executed or a halt condition is met. Timers tick every
+        instructions_per_frame cycles. With a cycle budget, wait loops are fast-forwarded to the next timer tick or
+        to the end of the run, whichever matters to them. A halt condition is checked after every instruction, and the
+        program counter is logged before every instruction at DEBUG level, so the block decoder runs one instruction at
+        a time through the opcode table while either is in use
+        :param cycles: number of instructions to execute, None to run until halted
+        :param until: callable taking the CPU, returning True to halt
+        :param render: update the screen on every draw, otherwise leave the draw flag set for the caller
+        :return: total cycles executed
+        """
+        cpu = self.cpu
+        if cpu.profiler is not None:
+            from profiler import run_profiled
+            return run_profiled(self, cycles, until, render)
+        trace = log.isEnabledFor(logging.DEBUG)
+        step = cpu.dispatch_opcode if (until is not None or trace) and cpu.blocks is not None else cpu.step
+        end = None if cycles is None else cpu.cycles + cycles
+        next_tick = self.next_tick()
+        cpu.horizon = 1 << 62 if end is None else end
+        cpu.timer_horizon = min(next_tick, cpu.horizon)
+        cpu.idle_until = 0 if end is None else end
+        while end is None or cpu.cycles < end:
+            if trace:
+                log.debug("PC: %s", hex(cpu.pc))
+            # a fast-forwarding instruction moves cpu.cycles itself, so read it only after the step
+            executed = step() or 1
+            cpu.cycles += executed
+            if cpu.cycles >= next_tick:
+                ticks = (cpu.cycles - next_tick) // self.instructions_per_frame + 1
+                cpu.tick_timers(ticks)
+                next_tick += ticks * self.instructions_per_frame
+                cpu.timer_horizon = min(next_tick, cpu.horizon)
+            if render and cpu.draw_flag:
+                cpu.update_screen()
+            if until is not None and until(cpu):
+                break
+        cpu.idle_until = 0
+        return cpu.cycles
+
+    def next_tick(self):
+        """
+        Cycle count at which the timers next tick
+        :return: int
+        """
+        return (self.cpu.cycles // self.instructions_per_frame + 1) * self.instructions_per_frame
 
     def load_font_set(self):
         """
-        Load the base font set
+        Load the base font set, and the large font on the extended profiles
         :return: None
         """
-        for loc, byte in enumerate(font_set):
-            self.cpu.write_memory(loc, byte)
+        self.cpu.write_memory_block(0, font_set)
+        if self.cpu.quirks.extended:
+            self.cpu.write_memory_block(big_font_address, big_font_set)
 
     def load_rom(self, rom):
         """
-        Load a new rom into memory
+        Load a new rom into memory. A missing file raises FileNotFoundError
         :param rom: binary
         :return: None
         """
-        try:
-            with open(rom, mode="rb") as file:
-                self.rom = file.read()
-            for loc, byte in enumerate(self.rom, start=0x200):
-                self.cpu.write_memory(loc, byte)
-        except FileNotFoundError:
-            print(f"File {rom} not found")
-            exit(1)
+        with open(rom, mode="rb") as file:
+            self.load_rom_data(file.read(max_rom_size + 1))
+
+    def load_rom_data(self, data):
+        """
+        Load rom bytes that are already in memory, or any buffer such as a RomLibrary view
+        :param data: bytes-like
+        :return: None
+        """
+        if not 0 < len(data) <= max_rom_size:
+            raise ValueError(f"Rom is {len(data)} bytes, expected 1 to {max_rom_size}")
+        self.rom = bytes(data)
+        self.cpu.write_memory_block(0x200, self.rom)
+
+    def set_key(self, key, pressed):
+        """
+        Press or release a key on the keypad
+        :param key: key index 0-F
+        :param pressed: bool
+        :return: None
+        """
+        self.cpu.keypad[key] = 1 if pressed else 0
 
 
 class CPU:
     """
-    Base class that controls the RAM, registers, sound, and any other internal state
+    Base class that controls the RAM, registers, sound, and any other internal state. Memory, registers, stack, keypad
+    and graphics are fixed size byte buffers. The screen is 64x32, or 128x64 on the extended quirks profiles, where low
+    resolution mode draws every pixel as a 2x2 block
     """
 
-    def __init__(self):
-        self.keypad = [0] * 16
-        self.v = [0] * 16
-        self.stack = [0] * 255
-        self.memory = [0] * 4096
-        self.gfx = [0] * 2048
+    __slots__ = ("decoder", "blocks", "step", "display", "cycles", "keypad", "v", "stack", "memory", "gfx", "pc", "I",
+                 "sp", "draw_flag", "delay_timer", "sound_timer", "sound_ticked", "paused", "profiler", "horizon",
+                 "timer_horizon", "idle_until", "rng", "quirks", "opcode_table", "width", "height", "hires", "rpl")
+
+    def __init__(self, decoder="table", display=None, rng=None, quirks="default"):
+        if decoder not in decoders:
+            raise ValueError(f"Unknown decoder {decoder}, expected one of {', '.join(decoders)}")
+        self.quirks = get_profile(quirks)
+        if decoder == "match" and self.quirks is not profiles["default"]:
+            raise ValueError("The match decoder only supports the default quirks profile")
+        self.opcode_table = get_opcode_table(self.quirks)
+        self.decoder = decoder
+        self.blocks = None
+        if decoder == "block":
+            from blocks import BlockCache
+            self.blocks = BlockCache(self.opcode_table, self.quirks)
+            self.step = self.execute_block
+        else:
+            self.step = self.dispatch_opcode if decoder == "table" else self.decode_opcode
+        self.display = display if display is not None else NullDisplay()
+        self.cycles = 0
+        self.keypad = bytearray(16)
+        self.v = bytearray(16)
+        self.stack = memoryview(bytearray(255 * 2)).cast("H")
+        self.memory = bytearray(4096)
+        self.width, self.height = (128, 64) if self.quirks.extended else (64, 32)
+        self.gfx = bytearray(self.width * self.height // 8)
+        self.hires = False
+        self.rpl = bytearray(16)
         self.pc = 0x200
         self.I = 0
         self.sp = 0
         self.draw_flag = False
         self.delay_timer = 0
         self.sound_timer = 0
+        self.sound_ticked = False
         self.paused = False
+        self.profiler = None
+        self.horizon = 1 << 62
+        self.timer_horizon = 1 << 62
+        self.idle_until = 0
+        self.rng = rng if rng is not None else Random()
 
     def write_register(self, num, val):
         """
@@ -98,8 +248,7 @@ class CPU:
         try:
             self.v[num] = val & 0xFF
         except IndexError:
-            print(f"Invalid register index {num}")
-            exit(1)
+            raise IndexError(f"Invalid register index {num}") from None
 
     def read_register(self, num):
         """
@@ -110,8 +259,7 @@ class CPU:
         try:
             return self.v[num]
         except IndexError:
-            print(f"Invalid register at {num}")
-            exit(1)
+            raise IndexError(f"Invalid register at {num}") from None
 
     def write_memory(self, loc, val):
         """
@@ -120,8 +268,25 @@ class CPU:
         :param val: value to be written
         :return: None
         """
+        val &= 0xFF
+        if self.blocks is not None and self.memory[loc] != val:
+            self.blocks.invalidate(loc)
         self.memory[loc] = val
 
+    def write_memory_block(self, loc, data):
+        """
+        Copy a run of bytes into memory starting at a given location
+        :param loc: starting address
+        :param data: bytes to be written
+        :return: None
+        """
+        end = loc + len(data)
+        if loc < 0 or end > len(self.memory):
+            raise IndexError(f"Memory access error at {end - 1}")
+        if self.blocks is not None:
+            self.blocks.clear()
+        self.memory[loc:end] = data
+
     def write_memory_2byte(self, loc, val):
         """
         Write a 2 byte value to a starting memory location
@@ -132,14 +297,90 @@ class CPU:
         self.write_memory(loc, (val & 0xFF00) >> 8)
         self.write_memory(loc + 1, val & 0xFF)
 
+    def state_views(self):
+        """
+        Zero-copy read-only views of the machine state buffers. Writes go through the CPU methods, which keep the block
+        cache in step with memory
+        :return: dict of memoryview
+        """
+        return {
+            "memory": memoryview(self.memory).toreadonly(),
+            "v": memoryview(self.v).toreadonly(),
+            "stack": self.stack.toreadonly(),
+            "keypad": memoryview(self.keypad).toreadonly(),
+            "gfx": memoryview(self.gfx).toreadonly(),
+        }
+
+    def framebuffer(self):
+        """
+        Zero-copy read-only view of the current frame: height rows of width / 8 bytes, one bit per pixel, most
+        significant bit on the left. numpy.unpackbits(numpy.frombuffer(view, numpy.uint8)).reshape(cpu.height,
+        cpu.width) gives the pixel array
+        :return: memoryview
+        """
+        return memoryview(self.gfx).toreadonly()
+
+    def state_size(self):
+        """
+        Length of a snapshot, which depends on the quirks profile
+        :return: int
+        """
+        return extended_state_size if self.quirks.extended else state_size
+
+    def snapshot(self):
+        """
+        Capture the full machine state, including the random generator, so a restored machine replays exactly. Every
+        snapshot is a full copy of a few kilobytes made with a single join; sharing between snapshots is left to
+        RewindBuffer's deltas rather than copy-on-write pages, which would cost a dirty check on every memory write
+        :return: bytes of length state_size()
+        """
+        header = state_header.pack(self.quirks.name.encode(), self.cycles, self.pc, self.I, self.sp, self.delay_timer,
+                                   self.sound_timer, self.draw_flag)
+        _, words, gauss_next = self.rng.getstate()
+        rng = rng_state.pack(*words, gauss_next is not None, gauss_next or 0.0)
+        state = b"".join((header, self.memory, self.v, self.stack.tobytes(), self.gfx, self.keypad, rng))
+        if self.quirks.extended:
+            state += bytes((self.hires,)) + self.rpl
+        return state
+
+    def restore(self, state):
+        """
+        Restore a state captured with snapshot on a CPU with the same quirks profile. Buffers are updated in place so
+        existing views stay valid
+        :param state: bytes from snapshot
+        :return: None
+        """
+        if len(state) != self.state_size():
+            raise ValueError(f"Expected a {self.state_size()} byte state, got {len(state)}")
+        name, *registers = state_header.unpack_from(state)
+        name = name.rstrip(b"\0").decode()
+        if name != self.quirks.name[:16]:
+            raise ValueError(f"State was captured under the {name} profile, the CPU runs {self.quirks.name}")
+        self.cycles, self.pc, self.I, self.sp, self.delay_timer, self.sound_timer, self.draw_flag = registers
+        view = memoryview(state)[state_header.size:]
+        for buffer in (self.memory, self.v, self.stack.cast("B"), self.gfx, self.keypad):
+            buffer[:] = view[:len(buffer)]
+            view = view[len(buffer):]
+        *words, has_gauss, gauss_next = rng_state.unpack_from(view)
+        self.rng.setstate((3, tuple(words), gauss_next if has_gauss else None))
+        view = view[rng_state.size:]
+        if self.quirks.extended:
+            self.hires = bool(view[0])
+            self.rpl[:] = view[1:]
+        if self.blocks is not None:
+            self.blocks.clear()
+
     def write_graphics(self, loc, val):
         """
-        Write to a given graphics memory location
-        :param loc: memory location
-        :param val: value to be written
+        Write to a given graphics memory location. Pixels are packed 8 to a byte, most significant bit leftmost
+        :param loc: pixel index
+        :param val: pixel value, lit when truthy
         :return: None
         """
-        self.gfx[loc] = val
+        if val:
+            self.gfx[loc >> 3] |= 0x80 >> (loc & 7)
+        else:
+            self.gfx[loc >> 3] &= ~(0x80 >> (loc & 7)) & 0xFF
 
     def read_memory(self, loc):
         """
@@ -150,7 +391,7 @@ class CPU:
         try:
             return self.memory[loc]
         except IndexError:
-            print(f"Memory access error at {loc}")
+            raise IndexError(f"Memory access error at {loc}") from None
 
     def read_graphics(self, loc):
         """
@@ -159,17 +400,9 @@ class CPU:
         :return: value
         """
         try:
-            return self.gfx[loc]
+            return (self.gfx[loc >> 3] >> (7 - (loc & 7))) & 1
         except IndexError:
-            print(f"Graphics memory access error at {loc}")
-
-    def cycle(self):
-        """
-        Lookup the next instruction and update screen if necessary
-        :return: None
-        """
-        self.decode_opcode()
-        if self.draw_flag: self.update_screen()
+            raise IndexError(f"Graphics memory access error at {loc}") from None
 
     def decode_opcode(self):
         """
@@ -177,6 +410,7 @@ class CPU:
         :return: None
         """
         op_code = self.read_memory(self.pc) << 8 | self.read_memory(self.pc + 1)
+        # 0000 does nothing and does not advance, so a rom that runs off its end waits there
         if op_code:
             try:
                 match op_code & 0xF000:
@@ -191,7 +425,7 @@ class CPU:
                                 self.pc = self.stack[self.sp]
                                 self.pc += 2
                             case _:
-                                print(f"Unknown opcode 0x{hex(op_code)}")
+                                raise IllegalInstruction(op_code, self.pc)
                     case 0x1000:  # 1NNN    Jumps to address NN
                         self.pc = op_code & 0x0FFF
                     case 0x2000:  # 2NNN	Calls subroutine at NNN
@@ -258,8 +492,7 @@ class CPU:
                                 self.write_register(0xF, self.read_register(v_x) >> 7)
                                 self.pc += 2
                             case _:
-                                print(f"Unknown opcode 0x{hex(op_code)}")
-                                exit(1)
+                                raise IllegalInstruction(op_code, self.pc)
                     case 0x9000:  # 9XY0	Skips the next instruction if VX doesn't equal VY
                         self.pc += 4 if self.read_register((op_code & 0x0F00) >> 8) != self.read_register(
                             (op_code & 0x00F0) >> 4) else 2
@@ -270,7 +503,7 @@ class CPU:
                         self.pc = (op_code & 0x0FFF) + self.read_register(0)
                     case 0xC000:  # CXNN	Sets VX to the result of a bitwise and operation on a random number (
                         # Typically: 0 to 255) and NN
-                        self.write_register((op_code & 0x0F00) >> 8, randint(0, 255) & (op_code & 0x00FF))
+                        self.write_register((op_code & 0x0F00) >> 8, self.rng.randint(0, 255) & (op_code & 0x00FF))
                         self.pc += 2
                     case 0xD000:  # DXYN - DRW Vx, Vy, nibble
                         self.write_register(0xF, 0)
@@ -299,7 +532,7 @@ class CPU:
                             case 0xA1:  # EXA1	Skips the next instruction if the key stored in VX isn't pressed
                                 self.pc += 4 if not self.keypad[self.read_register((op_code & 0x0F00) >> 8)] else 2
                             case _:
-                                print(f"Unknown opcode 0x{hex(op_code)}")
+                                raise IllegalInstruction(op_code, self.pc)
                     case 0xF000:
                         match op_code & 0x00FF:
                             case 0x07:  # FX07	Sets VX to the value of the delay timer
@@ -313,6 +546,7 @@ class CPU:
                                         key_pressed = True
                                 if not key_pressed:
                                     return
+                                self.pc += 2
                             case 0x15:  # FX15	Sets the delay timer to VX
                                 self.delay_timer = self.read_register((op_code & 0x0F00) >> 8)
                                 self.pc += 2
@@ -345,32 +579,79 @@ class CPU:
                                 for i in range(reg + 1):
                                     self.write_register(i, self.read_memory(self.I + i))
                                 self.pc += 2
+                            case _:
+                                raise IllegalInstruction(op_code, self.pc)
                     case _:
-                        print(f"Unknown opcode {hex(op_code)}")
-                        self.pc += 2
+                        raise IllegalInstruction(op_code, self.pc)
             except TypeError as inst:
-                print(f"Couldn't decode {hex(op_code)} at {hex(self.pc)}")
-                print(type(inst))
-                print(inst.args)
-                print(inst)
+                raise IllegalInstruction(op_code, self.pc) from inst
+
+    def dispatch_opcode(self):
+        """
+        Execute the next instruction through the precompiled opcode table
+        :return: number of instructions executed
+        """
+        memory = self.memory
+        self.opcode_table[memory[self.pc] << 8 | memory[self.pc + 1]](self)
+        return 1
+
+    def execute_block(self):
+        """
+        Execute the translated block starting at the program counter
+        :return: number of instructions executed
+        """
+        return self.blocks.execute(self)
+
+    def tick_timers(self, ticks=1):
+        """
+        Count the delay and sound timers down, called at 60 Hz. sound_ticked is set if the sound timer was running
+        :param ticks: number of ticks to apply at once
+        :return: None
+        """
+        if self.sound_timer:
+            self.sound_ticked = True
+        self.delay_timer = max(self.delay_timer - ticks, 0)
+        self.sound_timer = max(self.sound_timer - ticks, 0)
+
+    def skip_idle(self):
+        """
+        Called by an instruction that waits in place (a jump to itself, or FX0A with no key down) and leaves the machine
+        unchanged until the next input event. Counts the remaining cycles up to idle_until as executed
+        :return: None
+        """
+        idle = self.idle_until - self.cycles - 1
+        if idle > 0:
+            self.cycles += idle
 
-                exit(1)
+    def skip_delay_poll(self):
+        """
+        Called by a jump back four bytes. When it closes an FX07, 3XNN/4XNN, 1NNN loop that keeps polling an unchanged
+        delay timer, the loop is a fixed point until the next timer tick, so whole iterations up to the tick are
+        counted as executed
+        :return: None
+        """
+        memory = self.memory
+        loop = self.pc
+        read = memory[loop] << 8 | memory[loop + 1]
+        test = memory[loop + 2] << 8 | memory[loop + 3]
+        x = (read & 0x0F00) >> 8
+        if read & 0xF0FF != 0xF007 or (test & 0x0F00) >> 8 != x or self.v[x] != self.delay_timer & 0xFF:
+            return
+        if test & 0xF000 == 0x3000:
+            waiting = self.v[x] != test & 0xFF
         else:
-            print("Nothing to do...")
+            waiting = test & 0xF000 == 0x4000 and self.v[x] == test & 0xFF
+        if waiting:
+            loops = (min(self.idle_until, self.timer_horizon) - self.cycles - 1) // 3
+            if loops > 0:
+                self.cycles += loops * 3
 
     def update_screen(self):
         """
         Draw the screen
         :return: None
         """
-        for y in range(32):
-            for x in range(64):
-                if self.read_graphics(x + (y * 64)) == 1:
-                    set_fill_color(Color.BLUE)
-                else:
-                    set_fill_color(Color.RED)
-                draw_rect(x * scalar, y * scalar, (x + scalar) * scalar, (y + scalar) * scalar)
-        delay_fps(1000)
+        self.display.draw(self.gfx)
         self.draw_flag = False
 
     def clear_graphics(self):
@@ -378,17 +659,451 @@ class CPU:
         Clear graphics memory
         :return:
         """
-        self.gfx = [0] * 2048
+        self.gfx[:] = bytes(len(self.gfx))
 
-    def start(self):
-        """
-        Start the CPU
-        :return: None
-        """
-        while is_run():
-            while not self.paused:
-                print(f"PC: {hex(self.pc)}")
-                self.cycle()
+
+def compile_opcode(op_code, quirks=None):
+    """
+    Build the handler for a single instruction with its operands already extracted, specialized for a quirks profile.
+    On the default profile handlers behave exactly like the matching case in CPU.decode_opcode
+    :param op_code: 16 bit instruction
+    :param quirks: Quirks, the default profile when None
+    :return: callable taking the CPU
+    """
+    if quirks is None:
+        quirks = profiles["default"]
+    legacy = quirks is profiles["default"]
+    x = (op_code & 0x0F00) >> 8
+    y = (op_code & 0x00F0) >> 4
+    n = op_code & 0x000F
+    nn = op_code & 0x00FF
+    nnn = op_code & 0x0FFF
+
+    def unknown(cpu):
+        raise IllegalInstruction(op_code, cpu.pc)
+
+    if not op_code:  # 0000	Does nothing and does not advance
+        def handler(cpu):
+            pass
+        return handler
+
+    match op_code & 0xF000:
+        case 0x0000:
+            match nn:
+                case 0xE0:  # 00E0  Clears the screen
+                    def handler(cpu):
+                        cpu.clear_graphics()
+                        cpu.pc += 2
+                        cpu.draw_flag = True
+                case 0xEE:  # 00EE Returns from subroutine
+                    def handler(cpu):
+                        cpu.sp -= 1
+                        cpu.pc = cpu.stack[cpu.sp] + 2
+                case _ if quirks.extended:
+                    handler = compile_extended(op_code)
+                case _:
+                    handler = unknown
+        case 0x1000:  # 1NNN    Jumps to address NNN
+            def handler(cpu):
+                pc = cpu.pc
+                cpu.pc = nnn
+                if nnn == pc:
+                    cpu.skip_idle()
+                elif nnn == pc - 4:
+                    cpu.skip_delay_poll()
+        case 0x2000:  # 2NNN	Calls subroutine at NNN
+            def handler(cpu):
+                cpu.stack[cpu.sp] = cpu.pc
+                cpu.sp += 1
+                cpu.pc = nnn
+        case 0x3000:  # 3XNN	Skips the next instruction if VX equals NN
+            def handler(cpu):
+                cpu.pc += 4 if cpu.v[x] == nn else 2
+        case 0x4000:  # 4XNN	Skips the next instruction if VX doesn't equal NN
+            def handler(cpu):
+                cpu.pc += 4 if cpu.v[x] != nn else 2
+        case 0x5000:  # 5XY0	Skips the next instruction if VX equals VY
+            def handler(cpu):
+                v = cpu.v
+                cpu.pc += 4 if v[x] == v[y] else 2
+        case 0x6000:  # 6XNN	Sets VX to NN
+            def handler(cpu):
+                cpu.v[x] = nn
+                cpu.pc += 2
+        case 0x7000:  # 7XNN    Adds NN to VX
+            def handler(cpu):
+                v = cpu.v
+                v[x] = (v[x] + nn) & 0xFF
+                cpu.pc += 2
+        case 0x8000:  # 8XYN
+            match n:
+                case 0x0:  # 8XY0	Sets VX to the value of VY
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] = v[y]
+                        cpu.pc += 2
+                case 0x1 | 0x2 | 0x3 if quirks.vf_reset:  # 8XY1, 8XY2 and 8XY3, clearing VF afterwards
+                    operation = (None, int.__or__, int.__and__, int.__xor__)[n]
+
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] = operation(v[x], v[y])
+                        v[0xF] = 0
+                        cpu.pc += 2
+                case 0x1:  # 8XY1	Sets VX to VX or VY
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] |= v[y]
+                        cpu.pc += 2
+                case 0x2:  # 8XY2	Sets VX to VX and VY
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] &= v[y]
+                        cpu.pc += 2
+                case 0x3:  # 8XY3	Sets VX to VX xor VY
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] ^= v[y]
+                        cpu.pc += 2
+                case 0x4:  # 8XY4	Adds VY to VX. VF is set to 1 when there's a carry
+                    def handler(cpu):
+                        v = cpu.v
+                        total = v[x] + v[y]
+                        v[x] = total & 0xFF
+                        v[0xF] = 1 if total > 255 else 0
+                        cpu.pc += 2
+                case 0x5:  # 8XY5	VY is subtracted from VX. VF is set to 0 when there's a borrow
+                    def handler(cpu):
+                        v = cpu.v
+                        total = v[x] - v[y]
+                        v[x] = total & 0xFF
+                        v[0xF] = 0 if total < 0 else 1
+                        cpu.pc += 2
+                case 0x6 if not legacy:  # 8XY6	Shifts VX, or VY, right by one. VF is set to the bit shifted out
+                    source = y if quirks.shift_vy else x
+
+                    def handler(cpu):
+                        v = cpu.v
+                        val = v[source]
+                        v[x] = val >> 1
+                        v[0xF] = val & 0x1
+                        cpu.pc += 2
+                case 0x6:  # 8XY6	Shifts VX right by one
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] >>= 1
+                        v[0xF] = v[x] & 0x1
+                        cpu.pc += 2
+                case 0x7:  # 8XY7	Sets VX to VY minus VX. VF is set to 0 when there's a borrow
+                    def handler(cpu):
+                        v = cpu.v
+                        total = v[y] - v[x]
+                        v[x] = total & 0xFF
+                        v[0xF] = 0 if total < 0 else 1
+                        cpu.pc += 2
+                case 0xE if not legacy:  # 8XYE	Shifts VX, or VY, left by one. VF is set to the bit shifted out
+                    source = y if quirks.shift_vy else x
+
+                    def handler(cpu):
+                        v = cpu.v
+                        val = v[source]
+                        v[x] = (val << 1) & 0xFF
+                        v[0xF] = val >> 7
+                        cpu.pc += 2
+                case 0xE:  # 8XYE	Shifts VX left by one
+                    def handler(cpu):
+                        v = cpu.v
+                        v[x] = (v[x] << 1) & 0xFF
+                        v[0xF] = v[x] >> 7
+                        cpu.pc += 2
+                case _:
+                    handler = unknown
+        case 0x9000:  # 9XY0	Skips the next instruction if VX doesn't equal VY
+            def handler(cpu):
+                v = cpu.v
+                cpu.pc += 4 if v[x] != v[y] else 2
+        case 0xA000:  # ANNN	Sets I to the address NNN
+            def handler(cpu):
+                cpu.I = nnn
+                cpu.pc += 2
+        case 0xB000:  # BNNN	Jumps to the address NNN plus V0, or BXNN to XNN plus VX
+            offset = x if quirks.jump_vx else 0
+
+            def handler(cpu):
+                cpu.pc = nnn + cpu.v[offset]
+        case 0xC000:  # CXNN	Sets VX to a random number and NN
+            def handler(cpu):
+                cpu.v[x] = cpu.rng.randint(0, 255) & nn
+                cpu.pc += 2
+        case 0xD000 if not legacy:  # DXYN - DRW Vx, Vy, nibble
+            handler = compile_draw(x, y, n, quirks)
+        case 0xD000:  # DXYN - DRW Vx, Vy, nibble
+            def handler(cpu):
+                v = cpu.v
+                v[0xF] = 0
+                v_x = v[x] % 64
+                v_y = v[y]
+                left = v_x >> 3
+                right = (left + 1) & 7
+                shift = v_x & 7
+                memory = cpu.memory
+                gfx = cpu.gfx
+                collision = 0
+                for row in range(n):
+                    sprite = memory[cpu.I + row]
+                    base = ((v_y + row) % 32) * 8
+                    bits = sprite >> shift
+                    collision |= gfx[base + left] & bits
+                    gfx[base + left] ^= bits
+                    if shift:
+                        bits = (sprite << (8 - shift)) & 0xFF
+                        collision |= gfx[base + right] & bits
+                        gfx[base + right] ^= bits
+                if collision:
+                    v[0xF] = 1
+                cpu.draw_flag = True
+                cpu.pc += 2
+        case 0xE000:
+            match nn:
+                case 0x9E:  # EX9E	Skips the next instruction if the key stored in VX is pressed
+                    def handler(cpu):
+                        cpu.pc += 4 if cpu.keypad[cpu.v[x]] else 2
+                case 0xA1:  # EXA1	Skips the next instruction if the key stored in VX isn't pressed
+                    def handler(cpu):
+                        cpu.pc += 4 if not cpu.keypad[cpu.v[x]] else 2
+                case _:
+                    handler = unknown
+        case _:
+            match nn:
+                case 0x07:  # FX07	Sets VX to the value of the delay timer
+                    def handler(cpu):
+                        cpu.v[x] = cpu.delay_timer & 0xFF
+                        cpu.pc += 2
+                case 0x0A:  # FX0A	A key press is awaited, and then stored in VX
+                    def handler(cpu):
+                        keypad = cpu.keypad
+                        key = -1
+                        for i in range(16):
+                            if keypad[i]:
+                                key = i
+                        if key < 0:
+                            cpu.skip_idle()
+                        else:
+                            cpu.v[x] = key
+                            cpu.pc += 2
+                case 0x15:  # FX15	Sets the delay timer to VX
+                    def handler(cpu):
+                        cpu.delay_timer = cpu.v[x]
+                        cpu.pc += 2
+                case 0x18:  # FX18	Sets the sound timer to VX
+                    def handler(cpu):
+                        cpu.sound_timer = cpu.v[x]
+                        cpu.pc += 2
+                case 0x1E:  # FX1E	Adds VX to I
+                    def handler(cpu):
+                        cpu.I += cpu.v[x]
+                        cpu.pc += 2
+                case 0x29:  # FX29	Sets I to the location of the sprite for the character in VX
+                    def handler(cpu):
+                        cpu.I = cpu.v[x] * 5
+                        cpu.pc += 2
+                case 0x33:  # FX33	Stores the Binary-coded decimal representation of VX at I, I + 1 and I + 2
+                    def handler(cpu):
+                        val = cpu.v[x]
+                        cpu.write_memory(cpu.I, val // 100)
+                        cpu.write_memory(cpu.I + 1, val // 10 % 10)
+                        cpu.write_memory(cpu.I + 2, val % 10)
+                        cpu.pc += 2
+                case 0x55:  # FX55	Stores V0 to VX in memory starting at address I
+                    increment = x + 1 if quirks.load_store_increment else 0
+
+                    def handler(cpu):
+                        for i in range(x + 1):
+                            cpu.write_memory(cpu.I + i, cpu.v[i])
+                        cpu.I += increment
+                        cpu.pc += 2
+                case 0x65:  # FX65	Fills V0 to VX with values from memory starting at address I
+                    increment = x + 1 if quirks.load_store_increment else 0
+
+                    def handler(cpu):
+                        v = cpu.v
+                        memory = cpu.memory
+                        for i in range(x + 1):
+                            v[i] = memory[cpu.I + i] & 0xFF
+                        cpu.I += increment
+                        cpu.pc += 2
+                case 0x30 if quirks.extended:  # FX30	Sets I to the large font character for VX
+                    def handler(cpu):
+                        cpu.I = big_font_address + (cpu.v[x] & 0xF) * 10
+                        cpu.pc += 2
+                case 0x75 if quirks.extended:  # FX75	Stores V0 to VX in the RPL flags
+                    def handler(cpu):
+                        cpu.rpl[:x + 1] = cpu.v[:x + 1]
+                        cpu.pc += 2
+                case 0x85 if quirks.extended:  # FX85	Fills V0 to VX from the RPL flags
+                    def handler(cpu):
+                        cpu.v[:x + 1] = cpu.rpl[:x + 1]
+                        cpu.pc += 2
+                case _:
+                    handler = unknown
+    return handler
+
+
+def compile_draw(x, y, n, quirks):
+    """
+    Build a DXYN handler for a profile other than the default. Each sprite row is XORed into a whole screen row held
+    as one integer, clipped or wrapped at the right edge. On the extended profiles DXY0 draws a 16x16 sprite, and low
+    resolution mode doubles every pixel
+    :param x: register holding the left edge
+    :param y: register holding the top edge
+    :param n: sprite height, 0 for a 16x16 sprite on the extended profiles
+    :param quirks: Quirks
+    :return: callable taking the CPU
+    """
+    clip = quirks.clip_sprites
+    extended = quirks.extended
+    large = extended and n == 0
+
+    def handler(cpu):
+        v = cpu.v
+        memory = cpu.memory
+        gfx = cpu.gfx
+        width = cpu.width
+        row_bytes = width >> 3
+        scale = 1 if cpu.hires or not extended else 2
+        lines = cpu.height // scale
+        if large:
+            sprite_width = 16
+            rows = [memory[cpu.I + 2 * row] << 8 | memory[cpu.I + 2 * row + 1] for row in range(16)]
+        else:
+            sprite_width = 8
+            rows = memory[cpu.I:cpu.I + n]
+        left = v[x] % (width // scale) * scale
+        top = v[y] % lines
+        mask = (1 << width) - 1
+        shift = width - left - sprite_width * scale
+        collision = 0
+        for row, bits in enumerate(rows):
+            line = top + row
+            if line >= lines:
+                if clip:
+                    break
+                line -= lines
+            if scale == 2:
+                if sprite_width == 8:
+                    bits = double_bits[bits]
+                else:
+                    bits = double_bits[bits >> 8] << 16 | double_bits[bits & 0xFF]
+            if shift >= 0:
+                placed = bits << shift
+            else:
+                placed = bits >> -shift
+                if not clip:
+                    placed |= (bits << (width + shift)) & mask
+            for base in range(line * scale * row_bytes, (line + 1) * scale * row_bytes, row_bytes):
+                current = int.from_bytes(gfx[base:base + row_bytes], "big")
+                collision |= current & placed
+                gfx[base:base + row_bytes] = (current ^ placed).to_bytes(row_bytes, "big")
+        v[0xF] = 1 if collision else 0
+        cpu.draw_flag = True
+        cpu.pc += 2
+
+    return handler
+
+
+def double(bits):
+    """
+    Repeat every bit of a sprite byte, for low resolution drawing on a high resolution screen
+    :param bits: sprite byte
+    :return: 16 bit int
+    """
+    doubled = 0
+    for pos in range(8):
+        if bits >> pos & 1:
+            doubled |= 3 << 2 * pos
+    return doubled
+
+
+double_bits = [double(bits) for bits in range(256)]
+
+
+def compile_extended(op_code):
+    """
+    Build a handler for the SCHIP screen control instructions: 00CN, 00FB, 00FC, 00FD, 00FE and 00FF. Scrolling moves
+    the 128x64 screen by high resolution pixels in either mode, as SCHIP 1.1 does
+    :param op_code: 16 bit instruction
+    :return: callable taking the CPU
+    """
+    nn = op_code & 0x00FF
+    if nn & 0xF0 == 0xC0:  # 00CN	Scrolls the screen down N lines
+        lines = nn & 0xF
+
+        def handler(cpu):
+            gfx = cpu.gfx
+            moved = lines * (cpu.width >> 3)
+            if moved:
+                gfx[moved:] = gfx[:len(gfx) - moved]
+                gfx[:moved] = bytes(moved)
+            cpu.draw_flag = True
+            cpu.pc += 2
+    elif nn in (0xFB, 0xFC):  # 00FB, 00FC	Scrolls the screen right or left by 4 pixels
+        right = nn == 0xFB
+
+        def handler(cpu):
+            gfx = cpu.gfx
+            row_bytes = cpu.width >> 3
+            mask = (1 << cpu.width) - 1
+            for base in range(0, len(gfx), row_bytes):
+                row = int.from_bytes(gfx[base:base + row_bytes], "big")
+                row = row >> 4 if right else (row << 4) & mask
+                gfx[base:base + row_bytes] = row.to_bytes(row_bytes, "big")
+            cpu.draw_flag = True
+            cpu.pc += 2
+    elif nn == 0xFD:  # 00FD	Exits the interpreter, which then waits in place
+        def handler(cpu):
+            cpu.skip_idle()
+    elif nn in (0xFE, 0xFF):  # 00FE, 00FF	Switches to low or high resolution and clears the screen
+        hires = nn == 0xFF
+
+        def handler(cpu):
+            cpu.hires = hires
+            cpu.clear_graphics()
+            cpu.draw_flag = True
+            cpu.pc += 2
+    else:
+        def handler(cpu):
+            raise IllegalInstruction(op_code, cpu.pc)
+    return handler
+
+
+class OpcodeTable(dict):
+    """
+    Opcode to handler lookup for one quirks profile, populated lazily the first time each opcode is executed
+    """
+
+    def __init__(self, quirks=None):
+        super().__init__()
+        self.quirks = quirks if quirks is not None else profiles["default"]
+
+    def __missing__(self, op_code):
+        handler = self[op_code] = compile_opcode(op_code, self.quirks)
+        return handler
+
+
+opcode_table = OpcodeTable()
+opcode_tables = {opcode_table.quirks: opcode_table}
+
+
+def get_opcode_table(quirks):
+    """
+    The shared opcode table of a quirks profile, created on first use
+    :param quirks: Quirks
+    :return: OpcodeTable
+    """
+    table = opcode_tables.get(quirks)
+    if table is None:
+        table = opcode_tables[quirks] = OpcodeTable(quirks)
+    return table
 
 
 def main():
@@ -396,16 +1111,19 @@ def main():
     Main function
     :return: 
     """
-    init_graph(64 * scalar, 32 * scalar)
-    set_render_mode(RenderMode.RENDER_MANUAL)
-    set_caption("Chip-8 Emulator")
-
-    emu = Emulator()
-    emu.load_rom(argv[1])
+    display = EasyGraphicsDisplay()
+    emu = Emulator(display=display, quirks=argv[2] if len(argv) > 2 else "default")
+    try:
+        emu.load_rom(argv[1])
+    except (OSError, ValueError) as error:
+        print(error)
+        display.close()
+        exit(1)
     emu.load_font_set()
     emu.start()
-    close_graph()
+    display.close()
 
 
 if __name__ == '__main__':
+    from easygraphics import easy_run
     easy_run(main)
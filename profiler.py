@@ -0,0 +1,145 @@
+import json
+from time import perf_counter
+
+
+def opcode_class(op_code):
+    """
+    Name the instruction kind of an opcode, e.g. 8XY4 or FX33
+    :param op_code: 16 bit instruction
+    :return: str
+    """
+    match op_code & 0xF000:
+        case 0x0000:
+            return f"00{op_code & 0xFF:02X}" if op_code & 0xFF in (0xE0, 0xEE) else "0NNN"
+        case 0x5000 | 0x9000:
+            return f"{op_code >> 12:X}XY0"
+        case 0x8000:
+            return f"8XY{op_code & 0xF:X}"
+        case 0xD000:
+            return "DXYN"
+        case 0xE000 | 0xF000:
+            return f"{op_code >> 12:X}X{op_code & 0xFF:02X}"
+        case 0x1000 | 0x2000 | 0xA000 | 0xB000:
+            return f"{op_code >> 12:X}NNN"
+    return f"{op_code >> 12:X}XNN"
+
+
+class Profiler:
+    """
+    Collects per address and per instruction kind execution counts and handler wall time, render time and cycles per
+    frame. Attach with CPU.profiler; Emulator.run only takes the instrumented path while one is attached
+    """
+
+    def __init__(self):
+        self.pc_counts = {}
+        self.pc_opcodes = {}
+        self.class_counts = {}
+        self.class_time = {}
+        self.render_count = 0
+        self.render_time = 0.0
+        self.frame_cycles = []
+        self.frame_start = 0
+
+    def record(self, pc, op_code, elapsed):
+        """
+        Record one executed instruction
+        :param pc: address of the instruction
+        :param op_code: 16 bit instruction
+        :param elapsed: handler wall time in seconds
+        :return: None
+        """
+        self.pc_counts[pc] = self.pc_counts.get(pc, 0) + 1
+        self.pc_opcodes[pc] = op_code
+        kind = opcode_class(op_code)
+        self.class_counts[kind] = self.class_counts.get(kind, 0) + 1
+        self.class_time[kind] = self.class_time.get(kind, 0.0) + elapsed
+
+    def record_render(self, cycles, elapsed):
+        """
+        Record one presented frame
+        :param cycles: CPU cycle count when the frame was presented
+        :param elapsed: render wall time in seconds
+        :return: None
+        """
+        self.render_count += 1
+        self.render_time += elapsed
+        self.frame_cycles.append(cycles - self.frame_start)
+        self.frame_start = cycles
+
+    def to_dict(self):
+        """
+        Summary of everything collected
+        :return: dict
+        """
+        return {
+            "instructions": sum(self.pc_counts.values()),
+            "pc_counts": {f"0x{pc:03X}": count for pc, count in sorted(self.pc_counts.items())},
+            "classes": {kind: {"count": count, "seconds": self.class_time[kind]}
+                        for kind, count in sorted(self.class_counts.items())},
+            "render": {"count": self.render_count, "seconds": self.render_time},
+            "frame_cycles": self.frame_cycles,
+        }
+
+    def to_json(self, path=None):
+        """
+        Export the summary as JSON
+        :param path: file to write, or None to return the text
+        :return: str or None
+        """
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is None:
+            return text
+        with open(path, "w") as file:
+            file.write(text)
+
+    def hot_addresses(self, limit=20):
+        """
+        Flat report of the most executed addresses
+        :param limit: number of rows
+        :return: str
+        """
+        total = sum(self.pc_counts.values()) or 1
+        rows = sorted(self.pc_counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+        lines = [f"{'addr':>6} {'count':>10} {'share':>7}  op"]
+        for pc, count in rows:
+            op_code = self.pc_opcodes[pc]
+            lines.append(f"0x{pc:04X} {count:>10} {count / total:>7.1%}  {op_code:04X} {opcode_class(op_code)}")
+        return "\n".join(lines)
+
+
+def run_profiled(emu, cycles=None, until=None, render=True):
+    """
+    Instrumented equivalent of Emulator.run, stepping one instruction at a time. The block decoder is profiled through
+    the opcode table, which executes the same instructions. Wait loops are not fast-forwarded, so every cycle is
+    recorded against the instruction that ran in it
+    :param emu: Emulator with a profiler attached to its CPU
+    :param cycles: number of instructions to execute, None to run until halted
+    :param until: callable taking the CPU, returning True to halt
+    :param render: update the screen on every draw, otherwise leave the draw flag set for the caller
+    :return: total cycles executed
+    """
+    cpu = emu.cpu
+    profiler = cpu.profiler
+    step = cpu.decode_opcode if cpu.decoder == "match" else cpu.dispatch_opcode
+    memory = cpu.memory
+    end = None if cycles is None else cpu.cycles + cycles
+    next_tick = emu.next_tick()
+    cpu.idle_until = 0
+    while end is None or cpu.cycles < end:
+        pc = cpu.pc
+        op_code = memory[pc] << 8 | memory[pc + 1]
+        started = perf_counter()
+        step()
+        profiler.record(pc, op_code, perf_counter() - started)
+        cpu.cycles += 1
+        if cpu.cycles >= next_tick:
+            ticks = (cpu.cycles - next_tick) // emu.instructions_per_frame + 1
+            cpu.tick_timers(ticks)
+            next_tick += ticks * emu.instructions_per_frame
+        if render and cpu.draw_flag:
+            started = perf_counter()
+            cpu.update_screen()
+            profiler.record_render(cpu.cycles, perf_counter() - started)
+        if until is not None and until(cpu):
+            break
+    return cpu.cycles
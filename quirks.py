@@ -0,0 +1,51 @@
+class Quirks:
+    """
+    Behaviour that differs between Chip-8 interpreters. A profile is fixed when a CPU is built: every opcode handler is
+    compiled for one profile, so choosing one costs nothing per instruction
+
+    shift_vy: 8XY6 and 8XYE shift VY into VX rather than shifting VX in place
+    load_store_increment: FX55 and FX65 leave I pointing past the last register
+    jump_vx: BNNN jumps to NNN plus VX, X being the top nibble of NNN, rather than plus V0
+    clip_sprites: sprites are cut off at the screen edges instead of wrapping around
+    vf_reset: 8XY1, 8XY2 and 8XY3 clear VF
+    extended: SCHIP opcodes, the 128x64 high resolution mode and the large font
+    """
+
+    def __init__(self, name, shift_vy=False, load_store_increment=False, jump_vx=False, clip_sprites=False,
+                 vf_reset=False, extended=False):
+        self.name = name
+        self.shift_vy = shift_vy
+        self.load_store_increment = load_store_increment
+        self.jump_vx = jump_vx
+        self.clip_sprites = clip_sprites
+        self.vf_reset = vf_reset
+        self.extended = extended
+
+    def __repr__(self):
+        return f"Quirks({self.name!r})"
+
+
+profiles = {
+    # the behaviour this interpreter has always had, and the only one the match decoder and the batch emulator support
+    "default": Quirks("default"),
+    # the original COSMAC VIP interpreter
+    "chip8": Quirks("chip8", shift_vy=True, load_store_increment=True, clip_sprites=True, vf_reset=True),
+    # SUPER-CHIP 1.1
+    "schip": Quirks("schip", jump_vx=True, clip_sprites=True, extended=True),
+    # XO-CHIP, limited to its quirks and the SCHIP instruction set it builds on
+    "xochip": Quirks("xochip", shift_vy=True, load_store_increment=True, extended=True),
+}
+
+
+def get_profile(quirks):
+    """
+    Look up a quirks profile
+    :param quirks: profile name or Quirks
+    :return: Quirks
+    """
+    if isinstance(quirks, Quirks):
+        return quirks
+    try:
+        return profiles[quirks]
+    except KeyError:
+        raise ValueError(f"Unknown quirks profile {quirks}, expected one of {', '.join(profiles)}") from None
@@ -0,0 +1,113 @@
+import hashlib
+import json
+from multiprocessing import Pool
+
+from inputlog import InputLog
+from main import Emulator
+
+
+def checkpoint_hashes(rom, log, cycles, interval, decoder="table", quirks="default"):
+    """
+    Replay a session and hash the full machine state every interval cycles
+    :param rom: rom bytes
+    :param log: InputLog, whose seed seeds the emulator
+    :param cycles: session length in cycles
+    :param interval: cycles between checkpoints
+    :param decoder: decoder to run the session with
+    :param quirks: quirks profile name
+    :return: list of hex digests, one per checkpoint
+    """
+    emu = Emulator(decoder, seed=log.seed, quirks=quirks)
+    emu.load_font_set()
+    emu.load_rom_data(rom)
+    hashes = []
+    while emu.cpu.cycles < cycles:
+        log.play(emu, min(interval, cycles - emu.cpu.cycles))
+        hashes.append(hashlib.sha1(emu.cpu.snapshot()).hexdigest())
+    return hashes
+
+
+def first_divergence(expected, actual, interval):
+    """
+    Cycle of the first checkpoint where two hash lists differ
+    :param expected: list of digests
+    :param actual: list of digests
+    :param interval: cycles between checkpoints
+    :return: cycle number or None if they agree
+    """
+    for pos, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return (pos + 1) * interval
+    if len(expected) != len(actual):
+        return min(len(expected), len(actual)) * interval
+    return None
+
+
+def compare_engines(rom, log, cycles, interval, decoder_a="match", decoder_b="block", quirks="default"):
+    """
+    Run the same session on two engines in lockstep checkpoints
+    :return: cycle of the first diverging checkpoint or None
+    """
+    return first_divergence(checkpoint_hashes(rom, log, cycles, interval, decoder_a, quirks),
+                            checkpoint_hashes(rom, log, cycles, interval, decoder_b, quirks), interval)
+
+
+def record_golden(path, rom, log, cycles, interval, decoder=None, quirks="default"):
+    """
+    Record a golden session: rom hash, quirks profile, seed, inputs and the checkpoint hashes of a reference engine.
+    The reference is the match decoder on the default profile, which is all it supports, and the table decoder on the
+    others
+    :return: None
+    """
+    if decoder is None:
+        decoder = "match" if quirks == "default" else "table"
+    golden = {
+        "rom": hashlib.sha256(rom).hexdigest(),
+        "quirks": quirks,
+        "seed": log.seed,
+        "inputs": log.to_bytes().hex(),
+        "cycles": cycles,
+        "interval": interval,
+        "hashes": checkpoint_hashes(rom, log, cycles, interval, decoder, quirks),
+    }
+    with open(path, "w") as file:
+        json.dump(golden, file, indent=1)
+
+
+def check_golden(path, rom, decoder="table"):
+    """
+    Replay a golden session on an engine, under the quirks profile it was recorded with
+    :param path: golden session file
+    :param rom: rom bytes
+    :param decoder: engine under test
+    :return: cycle of the first diverging checkpoint or None
+    """
+    with open(path) as file:
+        golden = json.load(file)
+    if golden["rom"] != hashlib.sha256(rom).hexdigest():
+        raise ValueError(f"{path} was recorded against a different rom")
+    log = InputLog.from_bytes(bytes.fromhex(golden["inputs"]), golden["seed"])
+    hashes = checkpoint_hashes(rom, log, golden["cycles"], golden["interval"], decoder, golden["quirks"])
+    return first_divergence(golden["hashes"], hashes, golden["interval"])
+
+
+def check_golden_job(job):
+    """
+    Pool worker for check_goldens
+    :param job: (golden path, rom path, decoder)
+    :return: (golden path, decoder, divergence)
+    """
+    path, rom_path, decoder = job
+    with open(rom_path, "rb") as file:
+        return path, decoder, check_golden(path, file.read(), decoder)
+
+
+def check_goldens(jobs, processes=None):
+    """
+    Check many golden sessions in parallel
+    :param jobs: list of (golden path, rom path, decoder)
+    :param processes: worker count, defaults to the number of cores
+    :return: iterator of (golden path, decoder, divergence) in completion order
+    """
+    with Pool(processes) as pool:
+        yield from pool.imap_unordered(check_golden_job, jobs)
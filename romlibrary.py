@@ -0,0 +1,161 @@
+import hashlib
+import json
+import mmap
+import os
+
+from main import max_rom_size
+
+index_version = 1
+rom_extensions = (".ch8", ".chip8", ".c8")
+
+
+class RomLibrary:
+    """
+    A directory of roms, memory-mapped once and indexed by the SHA-256 of their contents, the same key the analyzer
+    cache uses. Files with identical contents share one mapping. Roms that are empty or too large for memory above
+    0x200 are kept out of the index and listed in rejected. Digests can be saved to an index file keyed by path, size
+    and modification time, so reopening a large library only hashes the files that changed
+    """
+
+    def __init__(self, directory, index_path=None, extensions=rom_extensions):
+        self.directory = directory
+        self.index_path = index_path
+        self.extensions = extensions
+        self.roms = {}
+        self.paths = {}
+        self.rejected = {}
+        self.scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.roms)
+
+    def __contains__(self, digest):
+        return digest in self.roms
+
+    def __iter__(self):
+        return iter(self.roms)
+
+    def scan(self):
+        """
+        Index every rom under the directory, mapping new files and dropping ones that disappeared
+        :return: None
+        """
+        known = self.read_index()
+        paths = {}
+        self.rejected = {}
+        for root, _, files in os.walk(self.directory):
+            for name in sorted(files):
+                if not name.lower().endswith(self.extensions):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                if not 0 < stat.st_size <= max_rom_size:
+                    self.rejected[path] = f"Rom is {stat.st_size} bytes, expected 1 to {max_rom_size}"
+                    continue
+                entry = known.get(path)
+                if entry is not None and entry[1:] != [stat.st_size, stat.st_mtime_ns]:
+                    entry = None
+                if entry is not None and entry[0] in self.roms:
+                    paths[path] = entry
+                    continue
+                rom = map_rom(path)
+                digest = entry[0] if entry is not None else hashlib.sha256(rom).hexdigest()
+                paths[path] = [digest, stat.st_size, stat.st_mtime_ns]
+                if digest in self.roms:
+                    rom.close()
+                else:
+                    self.roms[digest] = rom
+        used = {entry[0] for entry in paths.values()}
+        for digest in [digest for digest in self.roms if digest not in used]:
+            release(self.roms.pop(digest))
+        self.paths = paths
+        self.write_index()
+
+    def read_index(self):
+        """
+        Digests saved by an earlier scan, or whatever this library already holds
+        :return: dict of path to [digest, size, mtime_ns]
+        """
+        if self.paths or self.index_path is None:
+            return self.paths
+        try:
+            with open(self.index_path) as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return data.get("paths", {}) if data.get("version") == index_version else {}
+
+    def write_index(self):
+        """
+        Save the digests of the current scan
+        :return: None
+        """
+        if self.index_path is not None:
+            with open(self.index_path, "w") as file:
+                json.dump({"version": index_version, "paths": self.paths}, file)
+
+    def digest(self, path):
+        """
+        Content hash of an indexed file
+        :param path: rom file inside the library
+        :return: hex digest
+        """
+        try:
+            return self.paths[os.path.join(self.directory, os.path.relpath(path, self.directory))][0]
+        except KeyError:
+            raise KeyError(self.rejected.get(path, f"Rom {path} is not in the library")) from None
+
+    def get(self, key):
+        """
+        Zero-copy view of a rom's contents
+        :param key: hex digest or path of an indexed file
+        :return: read-only memoryview
+        """
+        return memoryview(self.roms[key] if key in self.roms else self.roms[self.digest(key)])
+
+    def load(self, emu, key):
+        """
+        Copy a rom into an emulator's memory in one block
+        :param emu: Emulator
+        :param key: hex digest or path of an indexed file
+        :return: None
+        """
+        emu.load_rom_data(self.get(key))
+
+    def close(self):
+        """
+        Unmap every rom
+        :return: None
+        """
+        for rom in self.roms.values():
+            release(rom)
+        self.roms.clear()
+        self.paths = {}
+
+
+def map_rom(path):
+    """
+    Memory-map a rom file read-only
+    :param path: rom file
+    :return: mmap
+    """
+    with open(path, "rb") as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def release(rom):
+    """
+    Unmap a rom, or leave it to the garbage collector while views of it are still in use
+    :param rom: mmap
+    :return: None
+    """
+    try:
+        rom.close()
+    except BufferError:
+        pass
@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+
+from inputlog import InputLog
+from main import Emulator
+from quirks import profiles
+from romlibrary import RomLibrary
+
+worker_roms = {}
+
+
+class Job:
+    """
+    One headless session: a rom, the key events to feed it, how many cycles to run and the quirks profile to run under
+    """
+
+    def __init__(self, rom, cycles, inputs=(), decoder="table", name=None, seed=None, quirks="default"):
+        self.rom = rom
+        self.cycles = cycles
+        self.inputs = inputs if isinstance(inputs, InputLog) else InputLog(inputs, seed)
+        self.decoder = decoder
+        self.quirks = quirks
+        self.name = name if name is not None else rom
+
+
+def read_input_script(path):
+    """
+    Read an input script, one "cycle key down|up" event per line. Blank lines and lines starting with # are ignored
+    :param path: script file
+    :return: list of (cycle, key, pressed)
+    """
+    events = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            cycle, key, state = line.split()
+            events.append((int(cycle), int(key, 16), state == "down"))
+    return events
+
+
+def run_session(rom, job):
+    """
+    Run one job to completion on a headless emulator
+    :param rom: rom bytes
+    :param job: Job
+    :return: dict with the final state, framebuffer hash and cycle count
+    """
+    started = time.perf_counter()
+    emu = Emulator(job.decoder, seed=job.inputs.seed, quirks=job.quirks)
+    emu.load_font_set()
+    emu.load_rom_data(rom)
+    cpu = emu.cpu
+    job.inputs.play(emu, job.cycles)
+    return {
+        "name": job.name,
+        "rom": job.rom,
+        "cycles": cpu.cycles,
+        "seconds": time.perf_counter() - started,
+        "framebuffer": hashlib.sha1(cpu.gfx).hexdigest(),
+        "state": {
+            "pc": cpu.pc,
+            "I": cpu.I,
+            "sp": cpu.sp,
+            "v": cpu.v.hex(),
+            "delay_timer": cpu.delay_timer,
+            "sound_timer": cpu.sound_timer,
+        },
+    }
+
+
+def init_worker(roms):
+    """
+    Receive the rom bytes once per worker process
+    :param roms: dict of rom name to bytes
+    :return: None
+    """
+    worker_roms.update(roms)
+
+
+def run_job(job):
+    """
+    Run a job inside a worker. Anything the session prints goes to stderr so stdout carries only results, and a session
+    that fails, even by calling exit, is reported instead of taking the worker down with it
+    :param job: Job
+    :return: result dict, or a dict with the name, rom and error of a failed session
+    """
+    try:
+        with redirect_stdout(sys.stderr):
+            return run_session(worker_roms[job.rom], job)
+    except (Exception, SystemExit) as error:
+        return {"name": job.name, "rom": job.rom, "error": f"{type(error).__name__}: {error}"}
+
+
+def run_jobs(jobs, processes=None, library=None):
+    """
+    Fan jobs out over a process pool, yielding results as they finish. Each rom is read once and shipped to every
+    worker when it starts, rather than with every job
+    :param jobs: list of Job
+    :param processes: worker count, defaults to the number of cores
+    :param library: RomLibrary to take roms from by path or digest instead of reading the files
+    :return: iterator of result dicts in completion order, failed sessions and roms that could not be read included
+    """
+    roms = {}
+    errors = {}
+    for job in jobs:
+        if job.rom in roms or job.rom in errors:
+            continue
+        try:
+            if library is not None:
+                roms[job.rom] = bytes(library.get(job.rom))
+            else:
+                with open(job.rom, mode="rb") as file:
+                    roms[job.rom] = file.read()
+        except (OSError, KeyError) as error:
+            errors[job.rom] = f"{type(error).__name__}: {error}"
+    for job in jobs:
+        if job.rom in errors:
+            yield {"name": job.name, "rom": job.rom, "error": errors[job.rom]}
+    jobs = [job for job in jobs if job.rom in roms]
+    if jobs:
+        with Pool(processes, initializer=init_worker, initargs=(roms,)) as pool:
+            yield from pool.imap_unordered(run_job, jobs)
+
+
+def main():
+    """
+    Run roms headless across all cores and print one JSON result per line
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Run Chip-8 roms headless in parallel")
+    parser.add_argument("roms", nargs="*", help="rom files")
+    parser.add_argument("--library", help="rom directory, every rom in it is run unless roms are given")
+    parser.add_argument("--cycles", type=int, default=100000, help="instructions to run per session")
+    parser.add_argument("--inputs", nargs="*", default=[], help="input scripts, each run against every rom")
+    parser.add_argument("--decoder", default="table", help="match, table or block")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for every session")
+    parser.add_argument("--quirks", default="default", help=f"quirks profile, one of {', '.join(profiles)}")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args()
+
+    if not args.library and not args.roms:
+        parser.error("give rom files or --library")
+    library = RomLibrary(args.library) if args.library else None
+    try:
+        roms = args.roms or list(library.paths)
+        scripts = [(path, read_input_script(path)) for path in args.inputs] or [(None, [])]
+        jobs = [Job(rom, args.cycles, events, args.decoder, f"{rom}:{script}" if script else rom, args.seed,
+                    args.quirks) for rom in roms for script, events in scripts]
+        for result in run_jobs(jobs, args.processes, library):
+            print(json.dumps(result), flush=True)
+    finally:
+        if library is not None:
+            library.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import struct
+import zlib
+from collections import deque
+
+magic = b"CH8S"
+version = 4
+file_header = struct.Struct("<4sHI")
+
+
+def xor_bytes(a, b):
+    """
+    XOR two equal length byte strings
+    :param a: bytes
+    :param b: bytes
+    :return: bytes
+    """
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+def save_state(cpu, path):
+    """
+    Write the machine state to disk: magic, format version and state size, then the zlib compressed snapshot
+    :param cpu: CPU
+    :param path: file to write
+    :return: None
+    """
+    with open(path, "wb") as file:
+        file.write(file_header.pack(magic, version, cpu.state_size()))
+        file.write(zlib.compress(cpu.snapshot()))
+
+
+def load_state(cpu, path):
+    """
+    Restore the machine state from a file written by save_state
+    :param cpu: CPU
+    :param path: file to read
+    :return: None
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    found, found_version, size = file_header.unpack_from(data)
+    if found != magic or found_version != version or size != cpu.state_size():
+        raise ValueError(f"{path} is not a version {version} save state")
+    cpu.restore(zlib.decompress(data[file_header.size:]))
+
+
+class RewindBuffer:
+    """
+    Ring buffer of per frame snapshots with bounded memory. Every keyframe_interval frames a full snapshot is kept; the
+    frames in between are stored as compressed XOR deltas against their keyframe. Whole keyframe groups are dropped
+    from the oldest end once more than capacity frames are held
+    """
+
+    def __init__(self, capacity=600, keyframe_interval=60):
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self.groups = deque()
+        self.frames = 0
+
+    def __len__(self):
+        return self.frames
+
+    def push(self, state):
+        """
+        Add the snapshot for the newest frame
+        :param state: bytes from CPU.snapshot
+        :return: None
+        """
+        if not self.groups or len(self.groups[-1][1]) + 1 >= self.keyframe_interval:
+            self.groups.append((state, []))
+        else:
+            keyframe, deltas = self.groups[-1]
+            deltas.append(zlib.compress(xor_bytes(state, keyframe), 1))
+        self.frames += 1
+        while self.frames - 1 - len(self.groups[0][1]) >= self.capacity:
+            self.frames -= 1 + len(self.groups.popleft()[1])
+
+    def get(self, back=0):
+        """
+        Snapshot of a frame counted back from the newest
+        :param back: 0 for the newest frame
+        :return: bytes
+        """
+        if not 0 <= back < self.frames:
+            raise IndexError(f"Only {self.frames} frames held")
+        for keyframe, deltas in reversed(self.groups):
+            held = len(deltas) + 1
+            if back < held:
+                pos = held - 1 - back
+                return keyframe if not pos else xor_bytes(zlib.decompress(deltas[pos - 1]), keyframe)
+            back -= held
+
+    def rewind(self, cpu, back=1):
+        """
+        Restore an earlier frame and drop every frame after it, so execution branches from there
+        :param cpu: CPU
+        :param back: frames to go back
+        :return: None
+        """
+        state = self.get(back)
+        for _ in range(back):
+            keyframe, deltas = self.groups[-1]
+            if deltas:
+                deltas.pop()
+            else:
+                self.groups.pop()
+            self.frames -= 1
+        cpu.restore(state)
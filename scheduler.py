@@ -0,0 +1,69 @@
+from time import perf_counter, sleep
+
+
+class FrameScheduler:
+    """
+    Paces an emulator in 60 Hz frames. Each frame runs up to the next timer tick, instructions_per_frame instructions on
+    the emulator, then presents the screen if anything was drawn. When throttled, frames are aligned to absolute
+    deadlines and the scheduler sleeps until the next one rather than spinning; unthrottled runs as fast as possible.
+    With an Audio attached, every frame also produces one frame of sound. Presented frames are reported to the CPU's
+    profiler when one is attached
+    """
+
+    def __init__(self, emu, hz=60, throttle=True, clock=perf_counter, sleeper=sleep, max_lag=5, audio=None):
+        self.emu = emu
+        self.audio = audio
+        self.hz = hz
+        self.throttle = throttle
+        self.clock = clock
+        self.sleeper = sleeper
+        self.max_lag = max_lag
+        self.frames = 0
+
+    def frame(self):
+        """
+        Run one frame of instructions, tick the timers and present the screen
+        :return: None
+        """
+        emu = self.emu
+        cpu = emu.cpu
+        # a frame sounds if it starts with the timer running or the timer is still running when it ticks at the end of
+        # the frame, so FX18 with N, N at least 1, sounds for exactly N frames
+        sounding = cpu.sound_timer > 0
+        cpu.sound_ticked = False
+        if cpu.paused:
+            cpu.tick_timers()
+        else:
+            emu.run(cycles=emu.next_tick() - cpu.cycles, render=False)
+        if self.audio is not None:
+            self.audio.frame(sounding or cpu.sound_ticked)
+        if cpu.draw_flag:
+            if cpu.profiler is None:
+                cpu.update_screen()
+            else:
+                started = perf_counter()
+                cpu.update_screen()
+                cpu.profiler.record_render(cpu.cycles, perf_counter() - started)
+        self.frames += 1
+
+    def run(self, frames=None):
+        """
+        Run frames until the display closes or a number of frames have been presented
+        :param frames: number of frames, None to run until the display closes
+        :return: number of frames run
+        """
+        display = self.emu.cpu.display
+        period = 1 / self.hz
+        deadline = self.clock()
+        end = None if frames is None else self.frames + frames
+        while (end is None or self.frames < end) and display.is_open():
+            self.frame()
+            if not self.throttle:
+                continue
+            deadline += period
+            remaining = deadline - self.clock()
+            if remaining > 0:
+                self.sleeper(remaining)
+            elif remaining < -self.max_lag * period:
+                deadline = self.clock()
+        return self.frames
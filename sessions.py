@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import struct
+from collections import deque
+from time import perf_counter
+
+from main import Emulator
+
+# frame number, payload length, followed by the packed screen
+frame_header = struct.Struct("<IH")
+
+
+class SessionStats:
+    """
+    Per session timing. Lag is how late a frame started against its 60 Hz deadline, input latency how long a key event
+    waited in the queue before the machine saw it. Recent samples are kept for percentiles. A session that stopped on
+    an error keeps it in error
+    """
+
+    def __init__(self, window=600):
+        self.error = None
+        self.frames = 0
+        self.dropped = 0
+        self.run_time = 0.0
+        self.lag = deque(maxlen=window)
+        self.input_latency = deque(maxlen=window)
+
+    def to_dict(self):
+        """
+        Summary of the recent samples
+        :return: dict
+        """
+        return {
+            "failed": self.error is not None,
+            "error": self.error,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "run_time": self.run_time,
+            "lag": summarize(self.lag),
+            "input_latency": summarize(self.input_latency),
+        }
+
+
+def summarize(samples):
+    """
+    Mean, 99th percentile and maximum of a set of samples
+    :param samples: iterable of float
+    :return: dict
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {"mean": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "max": ordered[-1],
+    }
+
+
+class Session:
+    """
+    One live emulator run as an asyncio task. Every frame it applies the queued key events, executes one frame of
+    instructions, pushes the screen to its subscribers if anything was drawn, then yields until the next frame. All
+    sessions sharing a loop advance one frame at a time in turn, so a busy rom can not starve the others. A rom that
+    fails stops only its own session, and its subscribers are sent None to tell them no more frames are coming
+    """
+
+    def __init__(self, name, emu, hz=60, clock=perf_counter):
+        self.name = name
+        self.emu = emu
+        self.hz = hz
+        self.clock = clock
+        self.keys = asyncio.Queue()
+        self.subscribers = set()
+        self.stats = SessionStats()
+        self.frame = 0
+        self.task = None
+        self.finished = False
+
+    def press(self, key, pressed):
+        """
+        Queue a key event for the start of the next frame
+        :param key: key index 0-F
+        :param pressed: bool
+        :return: None
+        """
+        self.keys.put_nowait((key, pressed, self.clock()))
+
+    def subscribe(self, depth=2):
+        """
+        Receive every frame drawn from now on. A subscriber that falls behind loses its oldest frames
+        :param depth: frames to buffer
+        :return: asyncio.Queue of (frame number, frame bytes), then None once the session has finished
+        """
+        queue = asyncio.Queue(depth)
+        if self.finished:
+            queue.put_nowait(None)
+        else:
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """
+        Stop sending frames to a subscriber
+        :param queue: queue returned by subscribe
+        :return: None
+        """
+        self.subscribers.discard(queue)
+
+    def step(self):
+        """
+        Run one frame: apply queued input, execute up to the next timer tick and publish the screen
+        :return: None
+        """
+        emu = self.emu
+        cpu = emu.cpu
+        started = self.clock()
+        while not self.keys.empty():
+            key, pressed, queued = self.keys.get_nowait()
+            emu.set_key(key, pressed)
+            self.stats.input_latency.append(started - queued)
+        emu.run(cycles=emu.next_tick() - cpu.cycles, render=False)
+        if cpu.draw_flag:
+            cpu.draw_flag = False
+            self.publish(bytes(cpu.gfx))
+        self.frame += 1
+        self.stats.frames += 1
+        self.stats.run_time += self.clock() - started
+
+    def publish(self, frame):
+        """
+        Hand a frame to every subscriber, dropping the oldest queued frame of any that is full
+        :param frame: frame bytes, or None to tell subscribers the session has finished
+        :return: None
+        """
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.stats.dropped += 1
+            queue.put_nowait((self.frame, frame) if frame is not None else None)
+
+    async def run(self, frames=None, throttle=True):
+        """
+        Run frames until cancelled, a number of frames have run or the rom fails. Subscribers are closed unless the
+        session was cancelled
+        :param frames: number of frames, None to run until cancelled
+        :param throttle: pace frames at hz, otherwise only yield between frames
+        :return: None
+        """
+        period = 1 / self.hz
+        deadline = self.clock()
+        end = None if frames is None else self.frame + frames
+        try:
+            while end is None or self.frame < end:
+                if throttle:
+                    self.stats.lag.append(max(self.clock() - deadline, 0.0))
+                self.step()
+                deadline += period
+                now = self.clock()
+                if throttle and now - deadline > 5 * period:
+                    deadline = now
+                await asyncio.sleep(max(deadline - now, 0) if throttle else 0)
+        except (Exception, SystemExit) as error:
+            self.stats.error = f"{type(error).__name__}: {error}"
+        self.finished = True
+        self.publish(None)
+        self.subscribers.clear()
+
+    def start(self, throttle=True):
+        """
+        Start the session task on the running loop
+        :param throttle: pace frames at hz
+        :return: asyncio.Task
+        """
+        self.task = asyncio.get_running_loop().create_task(self.run(throttle=throttle))
+        return self.task
+
+
+class SessionServer:
+    """
+    Hosts named sessions in one process and serves them over a Unix socket. A client sends the session name on the
+    first line, then "key <hex key> down|up" lines, and receives every drawn frame as a frame_header and the packed
+    screen
+    """
+
+    def __init__(self, hz=60, throttle=True):
+        self.hz = hz
+        self.throttle = throttle
+        self.sessions = {}
+        self.server = None
+
+    def add(self, name, rom, **options):
+        """
+        Create and start a session running a rom
+        :param name: session name
+        :param rom: rom bytes
+        :param options: Emulator options such as decoder, seed or quirks
+        :return: Session
+        """
+        if name in self.sessions:
+            raise ValueError(f"Session {name} already exists")
+        emu = Emulator(**options)
+        emu.load_font_set()
+        emu.load_rom_data(rom)
+        session = self.sessions[name] = Session(name, emu, self.hz)
+        session.start(self.throttle)
+        return session
+
+    async def remove(self, name):
+        """
+        Stop and forget a session
+        :param name: session name
+        :return: None
+        """
+        session = self.sessions.pop(name)
+        session.task.cancel()
+        try:
+            await session.task
+        except asyncio.CancelledError:
+            pass
+
+    async def serve(self, path):
+        """
+        Start listening on a Unix socket
+        :param path: socket path
+        :return: None
+        """
+        self.server = await asyncio.start_unix_server(self.handle_client, path)
+
+    async def close(self):
+        """
+        Stop serving and stop every session
+        :return: None
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for name in list(self.sessions):
+            await self.remove(name)
+
+    def stats(self):
+        """
+        Timing of every session
+        :return: dict of session name to stats dict
+        """
+        return {name: session.stats.to_dict() for name, session in self.sessions.items()}
+
+    async def handle_client(self, reader, writer):
+        """
+        Attach a socket client to a session: forward its key lines and stream frames back until either side closes
+        :param reader: asyncio.StreamReader
+        :param writer: asyncio.StreamWriter
+        :return: None
+        """
+        session = self.sessions.get((await reader.readline()).decode().strip())
+        if session is None:
+            writer.close()
+            return
+        frames = session.subscribe()
+        sender = asyncio.get_running_loop().create_task(send_frames(frames, writer))
+        try:
+            while line := await reader.readline():
+                parts = line.decode().split()
+                if len(parts) == 3 and parts[0] == "key" and parts[2] in ("down", "up"):
+                    session.press(int(parts[1], 16) & 0xF, parts[2] == "down")
+        finally:
+            session.unsubscribe(frames)
+            sender.cancel()
+            writer.close()
+
+
+async def send_frames(frames, writer):
+    """
+    Write frames from a subscriber queue to a socket, waiting for the socket to drain after each, and close the socket
+    once the session has finished
+    :param frames: subscriber queue
+    :param writer: asyncio.StreamWriter
+    :return: None
+    """
+    while (item := await frames.get()) is not None:
+        number, frame = item
+        writer.write(frame_header.pack(number, len(frame)) + frame)
+        await writer.drain()
+    writer.close()
+
+
+async def read_frame(reader):
+    """
+    Read one frame sent by a SessionServer
+    :param reader: asyncio.StreamReader
+    :return: (frame number, frame bytes)
+    """
+    number, length = frame_header.unpack(await reader.readexactly(frame_header.size))
+    return number, await reader.readexactly(length)
+
+
+async def serve_forever(path, roms, **options):
+    """
+    Serve one session per rom, named after the file, until cancelled
+    :param path: socket path
+    :param roms: list of rom files
+    :param options: Emulator options
+    :return: None
+    """
+    server = SessionServer()
+    for rom in roms:
+        with open(rom, "rb") as file:
+            server.add(rom, file.read(), **options)
+    await server.serve(path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    """
+    Serve roms as live sessions over a Unix socket
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Serve Chip-8 sessions over a Unix socket")
+    parser.add_argument("socket", help="socket path")
+    parser.add_argument("roms", nargs="+", help="rom files, one session each")
+    parser.add_argument("--decoder", default="table", help="match, table or block")
+    parser.add_argument("--quirks", default="default", help="quirks profile")
+    args = parser.parse_args()
+    asyncio.run(serve_forever(args.socket, args.roms, decoder=args.decoder, quirks=args.quirks))
+
+
+if __name__ == '__main__':
+    main()
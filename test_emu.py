@@ -1,4 +1,10 @@
-from main import Emulator, CPU
+import json
+import sys
+
+import pytest
+
+from display import FramebufferDisplay, dirty_spans
+from main import Emulator, CPU, IllegalInstruction, decoders
 
 
 def test_emulator_font_load():
@@ -25,13 +31,30 @@ def test_memory_2byte_write():
     assert emu.cpu.read_memory(0x200) == 0xDE and emu.cpu.read_memory(0x201) == 0xEF
 
 
-"""
+def assemble(program):
+    return b"".join(op_code.to_bytes(2, "big") for op_code in program)
+
+
+def load_program(emu, program):
+    emu.load_rom_data(assemble(program))
+
+
+class ClosingDisplay(FramebufferDisplay):
+    def __init__(self, frames):
+        super().__init__()
+        self.remaining = frames
+
+    def is_open(self):
+        self.remaining -= 1
+        return self.remaining >= 0
+
+
 def test_emulator_start():
-    emu = Emulator()
+    emu = Emulator(display=ClosingDisplay(3))
     emu.load_rom("test.chip8")
     emu.load_font_set()
     emu.start()
-    """
+    assert emu.cpu.cycles == 3 * emu.instructions_per_frame
 
 
 def test_00e0():
@@ -110,3 +133,846 @@ def test_font_set():
     emu = Emulator()
     emu.load_font_set()
     assert emu.cpu.read_memory(0x1) == 0x90
+
+
+def test_decoder_selection():
+    assert Emulator().cpu.decoder == "table"
+    assert Emulator("match").cpu.decoder == "match"
+    with pytest.raises(ValueError):
+        Emulator("bogus")
+
+
+def test_decoders_agree():
+    program = [0x6A05, 0x6B0C, 0x8AB4, 0x8AB5, 0x8AB7, 0x8A06, 0x8A0E, 0x7AFF, 0x8AB1, 0x8AB2, 0x8AB3,
+               0xA050, 0xFA1E, 0xFB29, 0xD0A5, 0xDAB3, 0x6C7B, 0xA300, 0xFC33, 0xFC55, 0xFB65, 0x3B05, 0x4B05,
+               0x5AB0, 0x9AB0, 0xFA15, 0xFB18, 0xFC07, 0x2240, 0x00E0]
+    states = []
+    for decoder in ("match", "table"):
+        emu = Emulator(decoder)
+        emu.load_font_set()
+        load_program(emu, program)
+        emu.cpu.write_memory_2byte(0x240, 0x00EE)
+        for _ in range(len(program) + 1):
+            emu.cpu.step()
+        cpu = emu.cpu
+        states.append((list(cpu.v), list(cpu.memory), list(cpu.gfx), cpu.pc, cpu.I, cpu.sp, cpu.delay_timer,
+                       cpu.sound_timer, cpu.draw_flag))
+    assert states[0] == states[1]
+
+
+def run_until(emu, pc, limit=1000):
+    while emu.cpu.pc != pc and limit:
+        emu.cpu.step()
+        limit -= 1
+    return emu.cpu
+
+
+def test_illegal_instruction(capsys):
+    for decoder in decoders:
+        for op_code in (0x0123, 0x8008, 0xE0FF, 0xF0FF):
+            emu = Emulator(decoder)
+            emu.cpu.write_memory_2byte(0x200, 0x6001)
+            emu.cpu.write_memory_2byte(0x202, op_code)
+            with pytest.raises(IllegalInstruction) as error:
+                emu.run(cycles=10)
+            assert error.value.pc == emu.cpu.pc == 0x202
+        emu = Emulator(decoder)
+        assert emu.run(cycles=100) == 100
+        assert emu.cpu.pc == 0x200
+    assert capsys.readouterr().out == ""
+
+
+def test_block_backend_self_modifying_code():
+    program = [0x2210, 0xA210, 0x6061, 0x6109, 0xF155, 0x6100, 0x2210, 0x120E, 0x6105, 0x6202, 0x00EE]
+    states = []
+    for decoder in ("table", "block"):
+        emu = Emulator(decoder)
+        load_program(emu, program)
+        cpu = run_until(emu, 0x20E)
+        assert cpu.read_register(1) == 0x09
+        states.append((list(cpu.v), list(cpu.memory), cpu.pc, cpu.I, cpu.sp))
+    assert states[0] == states[1]
+
+
+def test_block_backend_loop():
+    program = [0x6000, 0x6100, 0x8014, 0x7101, 0x8A06, 0x8AB4, 0xA300, 0xF01E, 0x3132, 0x1204, 0x1214]
+    states = []
+    for decoder in ("table", "block"):
+        emu = Emulator(decoder)
+        load_program(emu, program)
+        cpu = run_until(emu, 0x214)
+        states.append((list(cpu.v), cpu.pc, cpu.I))
+    assert states[0] == states[1]
+
+
+def test_block_owners_stay_bounded():
+    emu = Emulator("block")
+    load_program(emu, [0xA205, 0x6061, 0x6100, 0xF055, 0x1200])
+    emu.run(cycles=50000)
+    blocks = emu.cpu.blocks
+    assert emu.cpu.memory[0x205] == 0x61
+    assert sum(len(owners) for owners in blocks.owners.values()) <= 10
+    assert all(len(set(owners)) == len(owners) for owners in blocks.owners.values())
+    for start in blocks.blocks:
+        blocks.translate(emu.cpu.memory, start)
+    blocks.invalidate(0x204)
+    assert all(set(owners) <= set(blocks.blocks) for owners in blocks.owners.values())
+
+
+def test_headless_run_cycles():
+    emu = Emulator()
+    emu.load_rom("test.chip8")
+    assert emu.run(cycles=100) == 100
+    assert emu.cpu.pc == 0x111
+    assert "easygraphics" not in sys.modules
+
+
+def test_headless_run_until():
+    for decoder in decoders:
+        emu = Emulator(decoder)
+        load_program(emu, [0x6000, 0x7001, 0x300A, 0x1202, 0x1208])
+        emu.run(until=lambda cpu: cpu.pc == 0x208)
+        assert emu.cpu.read_register(0) == 10
+        # the condition holds in the middle of a block
+        emu = Emulator(decoder)
+        load_program(emu, [0x6000, 0x7001, 0x7101, 0x1202])
+        assert emu.run(until=lambda cpu: cpu.pc == 0x204) == 2
+
+
+def test_framebuffer_display():
+    display = FramebufferDisplay()
+    emu = Emulator(display=display)
+    emu.load_font_set()
+    emu.cpu.write_memory_2byte(0x200, 0xD005)
+    emu.run(cycles=1)
+    assert display.frames == 1
+    assert display.frame[0] == 0xF0 and not any(display.frame[1:8])
+
+
+def test_dirty_spans():
+    previous = bytes(256)
+    frame = bytearray(256)
+    assert dirty_spans(previous, frame) == []
+    frame[8] = 0x1E
+    frame[9] = 0x80
+    assert dirty_spans(previous, frame) == [(1, 3, 7, 1), (1, 8, 9, 1)]
+    previous, frame = bytes(frame), bytearray(frame)
+    frame[8] = 0x16
+    frame[255] = 0x01
+    assert dirty_spans(previous, frame) == [(1, 4, 5, 0), (31, 63, 64, 1)]
+
+
+def test_dxyn_wraps_and_collides():
+    for decoder in ("match", "table"):
+        emu = Emulator(decoder)
+        cpu = emu.cpu
+        cpu.write_memory(0x300, 0xFF)
+        cpu.write_memory(0x301, 0x81)
+        cpu.I = 0x300
+        cpu.write_register(0, 60)
+        cpu.write_register(1, 31)
+        load_program(emu, [0xD012, 0xD012])
+        cpu.step()
+        assert cpu.read_register(0xF) == 0
+        assert [cpu.read_graphics(31 * 64 + x) for x in (59, 60, 63, 0, 3, 4)] == [0, 1, 1, 1, 1, 0]
+        assert [cpu.read_graphics(x) for x in (60, 61, 3)] == [1, 0, 1]
+        cpu.step()
+        assert cpu.read_register(0xF) == 1
+        assert not any(cpu.gfx)
+
+
+def test_compact_state():
+    emu = Emulator()
+    emu.load_rom("test.chip8")
+    cpu = emu.cpu
+    cpu.write_memory(0x300, 0x1FF)
+    assert cpu.read_memory(0x300) == 0xFF
+    views = cpu.state_views()
+    cpu.write_memory(0x301, 0x42)
+    assert views["memory"][0x301] == 0x42
+    # writes through a view would bypass the block cache
+    for view in views.values():
+        with pytest.raises(TypeError):
+            view[0] = 1
+    assert views["memory"][0x200:0x204] == bytes([0x00, 0xE0, 0x11, 0x11])
+    with pytest.raises(AttributeError):
+        emu.cpu.extra = 1
+    with pytest.raises(IndexError):
+        cpu.write_memory_block(0xFFF, b"\x01\x02")
+    assert len(cpu.memory) == 4096
+
+
+def test_batch_matches_scalar():
+    np = pytest.importorskip("numpy")
+    from batch import BatchEmulator, cpu_state
+    program = [0x6A05, 0x6B0C, 0x6E03, 0x8AB4, 0x8AB5, 0x8AB7, 0x8A06, 0x8AEE, 0x7AFF, 0x8AB1, 0x8AB2, 0x8AB3,
+               0xA050, 0xFA1E, 0xF029, 0xD0A5, 0xDAB3, 0xA300, 0xF133, 0xF255, 0xF365, 0x3105, 0x4B05, 0x5AB0,
+               0x9AB0, 0xF215, 0xF318, 0xF407, 0x2260, 0xE99E, 0x6701, 0xE9A1, 0x6801, 0x6D00, 0x00E0, 0x7C01,
+               0x3C03, 0x1200, 0xF60A]
+    subroutine = [0x8104, 0x00EE]
+    lanes = 8
+    batch = BatchEmulator(lanes)
+    batch.load_font_set()
+    rom = bytearray(0x70)
+    rom[:len(program) * 2] = assemble(program)
+    rom[0x60:0x64] = assemble(subroutine)
+    batch.load_rom(bytes(rom))
+    emus = []
+    for lane in range(lanes):
+        emu = Emulator()
+        emu.load_font_set()
+        emu.cpu.write_memory_block(0x200, rom)
+        for reg in range(4):
+            emu.cpu.write_register(reg, (lane * 37 + reg * 11) & 0xFF)
+            batch.v[lane, reg] = (lane * 37 + reg * 11) & 0xFF
+        emu.cpu.write_register(9, lane % 3)
+        batch.v[lane, 9] = lane % 3
+        emu.cpu.keypad[lane] = 1
+        batch.keypad[lane, lane] = 1
+        emus.append(emu)
+    batch.run(150)
+    assert not batch.halted.any()
+    for lane, emu in enumerate(emus):
+        emu.run(cycles=150)
+        assert batch.lane_state(lane) == cpu_state(emu.cpu)
+
+    # a delay timer wait, which only ends if the timers tick on the scalar engine's frame boundaries
+    timer = assemble([0x6005, 0xF015, 0xF107, 0x3100, 0x1204, 0x120A])
+    for instructions_per_frame in (7, 10):
+        batch = BatchEmulator(2, instructions_per_frame=instructions_per_frame)
+        batch.load_rom(timer)
+        batch.run(500)
+        emu = Emulator(instructions_per_frame=instructions_per_frame)
+        emu.load_rom_data(timer)
+        emu.run(cycles=500)
+        assert emu.cpu.pc == 0x20A and emu.cpu.delay_timer == 0
+        assert batch.lane_state(0) == batch.lane_state(1) == cpu_state(emu.cpu)
+
+
+def test_runner_session_with_inputs():
+    from runner import Job, run_session
+    rom = bytes([0xF0, 0x0A, 0x12, 0x00])
+    result = run_session(rom, Job("keys", 50, [(10, 0x7, True)]))
+    assert result["cycles"] == 50
+    assert bytes.fromhex(result["state"]["v"])[0] == 0x7
+
+
+def test_runner_pool():
+    from runner import Job, run_jobs
+    results = list(run_jobs([Job("test.chip8", 200), Job("test.chip8", 100, decoder="block")], processes=2))
+    assert sorted(result["cycles"] for result in results) == [100, 200]
+    assert len({result["framebuffer"] for result in results}) == 1
+
+
+def test_runner_reports_failed_sessions(tmp_path):
+    from runner import Job, run_jobs
+    bad = tmp_path / "bad.ch8"
+    bad.write_bytes(bytes([0x60, 0x01, 0x80, 0x08]))
+    missing = tmp_path / "missing.ch8"
+    jobs = [Job(str(bad), 100), Job(str(missing), 100), Job("test.chip8", 100)]
+    results = {result["name"]: result for result in run_jobs(jobs, 2)}
+    assert results[str(bad)]["error"] == "IllegalInstruction: Unknown opcode 0x8008 at 0x202"
+    assert results[str(missing)]["error"].startswith("FileNotFoundError")
+    assert results["test.chip8"]["cycles"] == 100
+
+
+def test_profiler():
+    from profiler import Profiler, opcode_class
+    assert [opcode_class(op) for op in (0x00E0, 0x0123, 0x8AB4, 0xD125, 0xF233, 0x6A01, 0x1200)] == \
+        ["00E0", "0NNN", "8XY4", "DXYN", "FX33", "6XNN", "1NNN"]
+    display = FramebufferDisplay()
+    emu = Emulator("block", display)
+    emu.load_font_set()
+    load_program(emu, [0x6000, 0x7001, 0xD005, 0x1202])
+    emu.cpu.profiler = Profiler()
+    assert emu.run(cycles=30) == 30
+    report = emu.cpu.profiler.to_dict()
+    assert report["instructions"] == 30
+    assert report["classes"]["DXYN"]["count"] == 10
+    assert report["render"]["count"] == display.frames == 10
+    assert report["frame_cycles"] == [3] * 10
+    assert emu.cpu.profiler.hot_addresses(1).splitlines()[1].startswith("0x0202")
+    # wait loops are profiled instruction by instruction rather than skipped
+    for decoder in decoders:
+        emu = Emulator(decoder)
+        load_program(emu, [0x1200])
+        emu.cpu.profiler = Profiler()
+        assert emu.run(cycles=1000) == 1000
+        assert emu.cpu.profiler.to_dict()["pc_counts"] == {"0x200": 1000}
+
+
+def test_snapshot_restore(tmp_path):
+    from savestate import load_state, save_state
+    emu = Emulator("block")
+    emu.load_font_set()
+    load_program(emu, [0x6000, 0x7001, 0xA000, 0xD005, 0x2208, 0x1202, 0xF018, 0x00EE])
+    emu.run(cycles=25)
+    state = emu.cpu.snapshot()
+    views = emu.cpu.state_views()
+    emu.run(cycles=40)
+    after = emu.cpu.snapshot()
+    emu.cpu.restore(state)
+    assert emu.cpu.snapshot() == state and views["gfx"].tobytes() == bytes(emu.cpu.gfx)
+    emu.run(cycles=40)
+    assert emu.cpu.snapshot() == after
+    save_state(emu.cpu, tmp_path / "state.ch8s")
+    fresh = Emulator()
+    load_state(fresh.cpu, tmp_path / "state.ch8s")
+    assert fresh.cpu.snapshot() == after
+    # the timers tick at the same points in a fresh emulator restored mid frame
+    fresh = Emulator()
+    fresh.cpu.restore(state)
+    fresh.run(cycles=40)
+    assert fresh.cpu.cycles == 65 and fresh.cpu.snapshot() == after
+    # states only load into a CPU running the profile they were captured under
+    chip8 = Emulator(quirks="chip8")
+    save_state(chip8.cpu, tmp_path / "chip8.ch8s")
+    with pytest.raises(ValueError):
+        fresh.cpu.restore(chip8.cpu.snapshot())
+    with pytest.raises(ValueError):
+        load_state(fresh.cpu, tmp_path / "chip8.ch8s")
+    assert fresh.cpu.snapshot() == after
+
+
+def test_rewind_buffer():
+    from savestate import RewindBuffer
+    emu = Emulator()
+    load_program(emu, [0x7001, 0xF018, 0xA000, 0xF055, 0x1200])
+    rewind = RewindBuffer(capacity=20, keyframe_interval=4)
+    frames = []
+    for _ in range(50):
+        emu.run(cycles=5)
+        frames.append(emu.cpu.snapshot())
+        rewind.push(frames[-1])
+    assert 20 <= len(rewind) < 24
+    assert [rewind.get(back) for back in range(20)] == frames[::-1][:20]
+    rewind.rewind(emu.cpu, 7)
+    assert emu.cpu.snapshot() == frames[-8] and rewind.get() == frames[-8]
+
+
+def test_timers_tick_per_frame():
+    emu = Emulator(instructions_per_frame=10)
+    load_program(emu, [0x6005, 0xF015, 0xF018, 0x1206])
+    emu.run(cycles=10)
+    assert emu.cpu.delay_timer == 4 and emu.cpu.sound_timer == 4
+    emu.run(cycles=35)
+    assert emu.cpu.delay_timer == 1
+    emu.run(cycles=100)
+    assert emu.cpu.delay_timer == 0 and emu.cpu.sound_timer == 0
+
+
+def test_delay_loop_matches_across_decoders():
+    program = [0x6A20, 0xFA15, 0xFB07, 0x7C01, 0x3B00, 0x1204, 0xD015, 0x6A10, 0xFA15, 0x8AC4, 0xFB07, 0x4B00,
+               0x1200, 0x1212]
+    states = []
+    for decoder in decoders:
+        emu = Emulator(decoder, instructions_per_frame=7, seed=1)
+        load_program(emu, program)
+        emu.run(cycles=3000)
+        states.append(emu.cpu.snapshot())
+    assert states[0] == states[1] == states[2]
+
+
+def test_key_wait_advances_on_press():
+    for decoder in decoders:
+        emu = Emulator(decoder)
+        load_program(emu, [0xF50A, 0x7501, 0x1204])
+        emu.run(cycles=50)
+        assert emu.cpu.pc == 0x200 and emu.cpu.cycles == 50
+        emu.cpu.keypad[0x7] = 1
+        emu.run(cycles=2)
+        assert emu.cpu.pc == 0x204 and emu.cpu.v[5] == 0x8
+
+
+def test_wait_loops_fast_forward():
+    # a busy wait on the delay timer, a draw, then a jump to itself
+    program = [0x6A30, 0xFA15, 0xFB07, 0x3B00, 0x1204, 0xD015, 0x120C]
+    states = []
+    for decoder in decoders:
+        emu = Emulator(decoder, instructions_per_frame=11, seed=1)
+        load_program(emu, program)
+        executed = []
+        emu.run(cycles=5000, until=lambda cpu: executed.append(cpu.cycles) and False)
+        states.append(emu.cpu.snapshot())
+        if decoder == "match":
+            assert len(executed) == 5000
+        else:
+            assert len(executed) < 5000 // 5
+    assert states[0] == states[1] == states[2]
+
+
+def test_scheduler():
+    from scheduler import FrameScheduler
+    display = FramebufferDisplay()
+    emu = Emulator(display=display, instructions_per_frame=12)
+    emu.load_font_set()
+    load_program(emu, [0xD005, 0xD005, 0xD005, 0x1200])
+    assert FrameScheduler(emu, throttle=False).run(frames=5) == 5
+    assert emu.cpu.cycles == 60 and display.frames == 5
+
+    now = [0.0]
+    sleeps = []
+
+    def sleeper(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    scheduler = FrameScheduler(emu, clock=lambda: now[0], sleeper=sleeper)
+    scheduler.run(frames=3)
+    assert sleeps == [pytest.approx(1 / 60)] * 3 and now[0] == pytest.approx(3 / 60)
+
+    # presented frames reach the profiler
+    from profiler import Profiler
+    emu.cpu.profiler = Profiler()
+    FrameScheduler(emu, throttle=False).run(frames=10)
+    report = emu.cpu.profiler.to_dict()
+    assert report["render"]["count"] == 10 and report["frame_cycles"][1:] == [12] * 9
+
+
+def test_trace_logs_every_instruction(caplog):
+    import logging
+    for decoder in decoders:
+        emu = Emulator(decoder)
+        load_program(emu, [0x6000, 0x7001, 0x7101, 0x1202])
+        caplog.clear()
+        with caplog.at_level(logging.DEBUG, logger="main"):
+            emu.run(cycles=5)
+        assert [record.getMessage() for record in caplog.records] == \
+            ["PC: 0x200", "PC: 0x202", "PC: 0x204", "PC: 0x206", "PC: 0x202"]
+
+
+def test_seeded_random():
+    for decoder in decoders:
+        values = []
+        for _ in range(2):
+            emu = Emulator(decoder, seed=7)
+            load_program(emu, [0xC0FF, 0xC1FF, 0xC2FF, 0x1206])
+            emu.run(cycles=3)
+            values.append(bytes(emu.cpu.v[:3]))
+        assert values[0] == values[1]
+    # a snapshot carries the generator, so a restored machine draws the same numbers
+    emu = Emulator(seed=7)
+    load_program(emu, [0xC0FF, 0xC1FF, 0x1200])
+    emu.run(cycles=5)
+    state = emu.cpu.snapshot()
+    emu.run(cycles=5)
+    other = Emulator()
+    other.cpu.restore(state)
+    other.run(cycles=5)
+    assert other.cpu.snapshot() == emu.cpu.snapshot()
+
+
+def test_input_log_round_trip(tmp_path):
+    from inputlog import InputLog
+    log = InputLog([(300, 0xA, True), (5, 1, True), (70000, 0xA, False)], seed=3)
+    assert log.events[0] == (5, 1, True)
+    assert InputLog.from_bytes(log.to_bytes(), 3) == log
+    assert len(log.to_bytes()) == 9
+    log.save(tmp_path / "session.ch8i")
+    assert InputLog.load(tmp_path / "session.ch8i") == log
+    for seed in (-5, 0, 1 << 70):
+        InputLog(log.events, seed).save(tmp_path / "seeded.ch8i")
+        assert InputLog.load(tmp_path / "seeded.ch8i") == InputLog(log.events, seed)
+    with pytest.raises(ValueError):
+        InputLog(log.events).save(tmp_path / "unseeded.ch8i")
+    tap = InputLog([(10, 5, True), (10, 5, False)])
+    assert tap.events == [(10, 5, True), (10, 5, False)]
+    assert InputLog.from_bytes(tap.to_bytes()) == tap
+
+
+def test_record_and_replay(tmp_path):
+    from inputlog import InputLog
+    from regression import check_golden, compare_engines, record_golden
+    # wait for a key, add it to a random number and draw the digit
+    program = [0xF00A, 0xC1FF, 0x8014, 0xF029, 0xD235, 0x7201, 0x1200]
+    rom = b"".join(op_code.to_bytes(2, "big") for op_code in program)
+
+    log = InputLog(seed=11)
+    emu = Emulator(seed=11)
+    emu.load_font_set()
+    emu.load_rom_data(rom)
+    for key in (3, 9, 0xC):
+        emu.run(cycles=17)
+        log.record(emu, key, True)
+        emu.run(cycles=5)
+        log.record(emu, key, False)
+    emu.run(cycles=40)
+    recorded = emu.cpu.snapshot()
+
+    replay = Emulator("block", seed=11)
+    replay.load_font_set()
+    replay.load_rom_data(rom)
+    log.play(replay, emu.cpu.cycles)
+    assert replay.cpu.snapshot() == recorded
+
+    assert compare_engines(rom, log, 500, 50) is None
+    record_golden(tmp_path / "golden.json", rom, log, 500, 50)
+    assert check_golden(tmp_path / "golden.json", rom, "block") is None
+    with open(tmp_path / "golden.json") as file:
+        golden = json.load(file)
+    golden["hashes"][3] = "0" * 40
+    with open(tmp_path / "golden.json", "w") as file:
+        json.dump(golden, file)
+    assert check_golden(tmp_path / "golden.json", rom, "table") == 200
+
+    # golden sessions carry their quirks profile
+    record_golden(tmp_path / "schip.json", rom, log, 500, 50, quirks="schip")
+    assert check_golden(tmp_path / "schip.json", rom, "block") is None
+    with open(tmp_path / "schip.json") as file:
+        assert json.load(file)["quirks"] == "schip"
+
+
+def test_benchmark_suite():
+    from benchmark import compare, run_suite, synthetic_roms
+    roms = synthetic_roms()
+    assert set(roms) == {"alu", "sprites", "calls", "memory", "clears"}
+    results = run_suite(cycles=500)
+    assert set(results) == {f"{name}/{engine}" for name in roms for engine in decoders}
+    assert all(result["ips"] > 0 and result["peak_bytes"] > 0 for result in results.values())
+    assert results["sprites/table"]["fps"] > 0
+    baseline = {"alu/table": dict(results["alu/table"], ips=results["alu/table"]["ips"] * 10)}
+    assert [key for key, _, _ in compare(results, baseline)] == ["alu/table"]
+    assert compare(results, results) == []
+
+
+def test_benchmark_roms_match_across_decoders():
+    from benchmark import synthetic_roms
+    for rom in synthetic_roms().values():
+        states = []
+        for decoder in decoders:
+            emu = Emulator(decoder, seed=0)
+            emu.load_font_set()
+            emu.load_rom_data(rom)
+            emu.run(cycles=2000)
+            states.append(emu.cpu.snapshot())
+        assert states[0] == states[1] == states[2]
+
+
+def test_disassemble():
+    from analyzer import disassemble
+    assert [disassemble(op) for op in (0x00E0, 0x00EE, 0x1228, 0x3A05, 0x8AB4, 0x8A0E, 0xB300, 0xD125, 0xE19E,
+                                       0xF20A, 0xF355, 0x0000, 0x812F)] == \
+        ["CLS", "RET", "JP 0x228", "SE VA, 0x05", "ADD VA, VB", "SHL VA", "JP V0, 0x300", "DRW V1, V2, 5", "SKP V1",
+         "LD V2, K", "LD [I], V3", "DW 0x0000", "DW 0x812F"]
+
+
+def test_analyzer_cfg(tmp_path):
+    from analyzer import analyze, analyze_cached, predecode
+    # 0x200 skip over a jump into a subroutine call, an indirect jump, then sprite data
+    rom = assemble([0x3000, 0x1208, 0x220C, 0xB210, 0x6001, 0x1200, 0xA212, 0x00EE, 0xF0F0, 0xF0F0])
+    analysis = analyze(rom)
+    assert sorted(analysis.blocks) == [0x200, 0x202, 0x204, 0x206, 0x208, 0x20C]
+    assert set(analysis.edges()) == {(0x200, 0x202), (0x200, 0x204), (0x202, 0x208), (0x204, 0x20C),
+                                     (0x204, 0x206), (0x208, 0x200)}
+    assert analysis.indirect == [0x206]
+    assert analysis.data == [(0x210, 0x214)]
+
+    cached = analyze_cached(rom, tmp_path)
+    assert cached.to_dict() == analysis.to_dict()
+    assert analyze_cached(rom, tmp_path).to_dict() == analysis.to_dict()
+    assert len(list(tmp_path.iterdir())) == 1
+
+    emu = Emulator("block")
+    emu.load_rom_data(rom)
+    predecode(emu.cpu, analysis)
+    assert set(analysis.blocks) <= set(emu.cpu.blocks.blocks)
+
+    # the SCHIP instructions are only code on the extended profiles
+    rom = assemble([0x00FF, 0x6001, 0xF030, 0xD010, 0x00C2, 0xF075, 0xF085, 0x00FD])
+    assert analyze(rom).data == [(0x202, 0x210)]
+    analysis = analyze(rom, quirks="schip")
+    assert analysis.data == [] and analysis.edges() == []
+    listing = analysis.listing()
+    assert all(mnemonic in listing for mnemonic in ("HIGH", "LD HF, V0", "SCD 2", "LD R, V0", "LD V0, R", "EXIT"))
+    emu = Emulator("block", quirks="schip")
+    emu.load_rom_data(rom)
+    predecode(emu.cpu, analysis)
+    assert 0x200 in emu.cpu.blocks.blocks
+    with pytest.raises(ValueError):
+        predecode(Emulator("block").cpu, analysis)
+
+
+def test_framebuffer_view():
+    np = pytest.importorskip("numpy")
+    emu = Emulator()
+    view = emu.cpu.framebuffer()
+    assert view.readonly and len(view) == 256
+    emu.cpu.write_graphics(64 * 3 + 10, 1)
+    pixels = np.unpackbits(np.frombuffer(view, np.uint8)).reshape(32, 64)
+    assert pixels[3, 10] == 1 and pixels.sum() == 1
+
+
+def test_frame_stream(tmp_path, monkeypatch):
+    import zlib
+    import framestream
+    from benchmark import synthetic_roms
+    from framestream import FrameStreamWriter, png_bytes, read_frames, record_frames, write_gif
+    emu = Emulator(seed=0)
+    emu.load_font_set()
+    emu.load_rom_data(synthetic_roms()["sprites"])
+    assert record_frames(emu, tmp_path / "run.ch8v", 30) > 0
+    frames = list(read_frames(tmp_path / "run.ch8v"))
+    assert frames[-1][1] == bytes(emu.cpu.gfx)
+
+    with FrameStreamWriter(tmp_path / "frames.ch8v") as writer:
+        expected = []
+        for frame in range(3000):
+            gfx = bytearray(256)
+            gfx[frame // 20 % 256] = frame // 20 % 255 + 1
+            if writer.write(gfx, frame):
+                expected.append((frame, bytes(gfx)))
+    assert writer.written == 150
+    assert list(read_frames(tmp_path / "frames.ch8v")) == expected
+
+    # the size comes from the first frame, and decoding holds at most a chunk of output at a time
+    with FrameStreamWriter(tmp_path / "hires.ch8v") as writer:
+        for frame in range(200):
+            writer.write(bytes([frame % 2 + 1]) * 1024, frame)
+        with pytest.raises(ValueError):
+            writer.write(bytes(256), 200)
+    monkeypatch.setattr(framestream, "chunk_size", 1024)
+    with open(tmp_path / "hires.ch8v", "rb") as file:
+        file.seek(framestream.file_header.size)
+        assert max(len(piece) for piece in framestream._inflate(file)) <= 1024
+    hires = [(frame, bytes([frame % 2 + 1]) * 1024) for frame in range(200)]
+    assert list(read_frames(tmp_path / "hires.ch8v")) == hires
+
+    png = png_bytes(expected[1][1], scale=2)
+    assert png.startswith(b"\x89PNG") and png[16:24] == (128).to_bytes(4, "big") + (64).to_bytes(4, "big")
+    data = zlib.decompress(png[png.index(b"IDAT") + 4:png.index(b"IEND") - 8])
+    assert len(data) == 64 * 17 and data[3:5] == b"\x00\x0c"
+    assert write_gif(expected[:5], tmp_path / "frames.gif", scale=2) == 5
+    gif = (tmp_path / "frames.gif").read_bytes()
+    assert gif.startswith(b"GIF89a") and gif.endswith(b"\x3b") and gif.count(b"\x21\xf9\x04") == 5
+
+
+def test_load_rom_errors(tmp_path):
+    emu = Emulator()
+    with pytest.raises(FileNotFoundError):
+        emu.load_rom(tmp_path / "missing.ch8")
+    with pytest.raises(ValueError):
+        emu.load_rom_data(bytes(0xE01))
+    emu.load_rom_data(bytes(range(256)) * 14)
+    assert emu.cpu.memory[0xFFF] == 0xFF
+
+
+def test_rom_library(tmp_path):
+    import hashlib
+    from romlibrary import RomLibrary
+    roms = tmp_path / "roms"
+    (roms / "nested").mkdir(parents=True)
+    (roms / "pong.ch8").write_bytes(b"\x12\x00")
+    (roms / "nested" / "copy.ch8").write_bytes(b"\x12\x00")
+    (roms / "other.ch8").write_bytes(b"\x60\x05\x12\x02")
+    (roms / "huge.ch8").write_bytes(bytes(0xE01))
+    (roms / "notes.txt").write_text("not a rom")
+    digest = hashlib.sha256(b"\x12\x00").hexdigest()
+
+    with RomLibrary(str(roms), index_path=str(tmp_path / "index.json")) as library:
+        assert len(library) == 2 and digest in library
+        assert list(library.rejected) == [str(roms / "huge.ch8")]
+        assert library.digest(str(roms / "nested" / "copy.ch8")) == digest
+        assert bytes(library.get(str(roms / "other.ch8"))) == b"\x60\x05\x12\x02"
+        emu = Emulator()
+        library.load(emu, str(roms / "other.ch8"))
+        emu.run(cycles=3)
+        assert emu.cpu.v[0] == 5
+        with pytest.raises(KeyError):
+            library.get(str(roms / "huge.ch8"))
+
+        (roms / "other.ch8").unlink()
+        library.scan()
+        assert list(library) == [digest]
+
+    with RomLibrary(str(roms), index_path=str(tmp_path / "index.json")) as library:
+        assert library.paths == json.loads((tmp_path / "index.json").read_text())["paths"]
+        assert bytes(library.get(digest)) == b"\x12\x00"
+
+
+def test_quirks_profiles():
+    # 8XY6, 8XYE and 8XY1, then FX55 and FX65 from the same address, then BNNN
+    program = [0x6181, 0x6203, 0x8126, 0x6381, 0x832E, 0x6405, 0x8401, 0xA300, 0xF455, 0xF565, 0x6005, 0x6140,
+               0xB120]
+    expected = {
+        "default": ((0x40, 0x02, 0x00), (0x10, 0x300, 0x125)),
+        "chip8": ((0x01, 0x06, 0x00), (0x15, 0x30B, 0x125)),
+        "schip": ((0x40, 0x02, 0x01), (0x10, 0x300, 0x160)),
+        "xochip": ((0x01, 0x06, 0x00), (0x15, 0x30B, 0x125)),
+    }
+    for name, (shifted, loaded) in expected.items():
+        states = []
+        for decoder in ("table", "block"):
+            emu = Emulator(decoder, seed=1, quirks=name)
+            load_program(emu, program)
+            emu.cpu.write_memory_block(0x305, bytes(range(0x10, 0x16)))
+            cpu = emu.cpu
+            emu.run(cycles=7)
+            assert (cpu.v[1], cpu.v[3], cpu.v[0xF]) == shifted, (name, decoder)
+            emu.run(cycles=len(program) - 7)
+            assert (cpu.v[5], cpu.I, cpu.pc) == loaded, (name, decoder)
+            states.append(cpu.snapshot())
+        assert states[0] == states[1]
+    with pytest.raises(ValueError):
+        Emulator("match", quirks="schip")
+    with pytest.raises(ValueError):
+        Emulator(quirks="cosmac")
+
+
+def test_sprite_clipping_and_wrapping():
+    # a 2 row sprite drawn at x 60, y 31
+    program = [0xA20A, 0x603C, 0x611F, 0xD012, 0x1208]
+    for name, clip in (("default", False), ("chip8", True), ("xochip", False)):
+        emu = Emulator(quirks=name)
+        load_program(emu, program)
+        emu.cpu.write_memory_block(0x20A, b"\xFF\xFF")
+        emu.run(cycles=4)
+        cpu = emu.cpu
+        scale = 2 if cpu.quirks.extended else 1
+        lit = {(x, y) for y in range(32) for x in range(64) if cpu.read_graphics(y * scale * cpu.width + x * scale)}
+        visible = {(x, 31) for x in range(60, 64)}
+        assert lit == visible if clip else lit == {(x % 64, y % 32) for x in range(60, 68) for y in (31, 32)}
+
+
+def test_schip_hires():
+    program = [0x00FF, 0xA300, 0x6078, 0x613C, 0xD010, 0x6A07, 0xFA30, 0xFA75, 0x6A00, 0xFA85, 0x00C2, 0x00FB,
+               0x00FD]
+    emu = Emulator("block", quirks="schip")
+    emu.load_font_set()
+    load_program(emu, program)
+    emu.cpu.write_memory_block(0x300, b"\xFF\xFF" * 16)
+    emu.run(cycles=len(program) + 20)
+    cpu = emu.cpu
+    assert cpu.hires and len(cpu.gfx) == 1024 and cpu.pc == 0x218
+    assert cpu.I == 0x50 + 70 and cpu.v[0xA] == 7 and cpu.rpl[0xA] == 7
+    # a 16x16 block drawn at 120, 60 clips to 8x4, then scrolls down 2 and right 4
+    lit = {(x, y) for y in range(64) for x in range(128) if cpu.read_graphics(y * 128 + x)}
+    assert lit == {(x, y) for x in range(124, 128) for y in (62, 63)}
+    state = cpu.snapshot()
+    assert len(state) == cpu.state_size()
+    other = Emulator(quirks="schip")
+    other.cpu.restore(state)
+    assert other.cpu.snapshot() == state and other.cpu.hires
+
+    lores = Emulator(quirks="schip")
+    lores.load_font_set()
+    lores.cpu.write_memory_block(0x200, bytes.fromhex("6102 6201 F129 D125"))
+    lores.run(cycles=4)
+    pixels = [[lores.cpu.read_graphics(y * 128 + x) for x in range(4, 12)] for y in range(2, 4)]
+    assert pixels == [[1, 1, 1, 1, 1, 1, 1, 1]] * 2
+
+
+def test_session_server(tmp_path):
+    import asyncio
+    from sessions import SessionServer, read_frame
+    # wait for a key, draw its digit and stop
+    rom = bytes.fromhex("F00A F029 D005 1206")
+
+    async def scenario():
+        server = SessionServer(throttle=False)
+        for name in ("a", "b", "c"):
+            server.add(name, rom, seed=1)
+        await server.serve(str(tmp_path / "chip8.sock"))
+        reader, writer = await asyncio.open_unix_connection(str(tmp_path / "chip8.sock"))
+        writer.write(b"b\nkey 5 down\n")
+        await writer.drain()
+        number, frame = await asyncio.wait_for(read_frame(reader), 5)
+        writer.close()
+        frames = [session.frame for session in server.sessions.values()]
+        stats = server.stats()
+        await server.close()
+        return number, frame, frames, stats
+
+    number, frame, frames, stats = asyncio.run(scenario())
+    assert len(frame) == 256 and any(frame)
+    assert max(frames) - min(frames) <= 1
+    assert stats["b"]["frames"] >= number and stats["b"]["input_latency"]["max"] >= 0
+    assert stats["a"]["input_latency"] == {"mean": 0.0, "p99": 0.0, "max": 0.0}
+
+
+def test_session_server_failed_session(tmp_path):
+    import asyncio
+    from sessions import SessionServer, read_frame
+
+    async def scenario():
+        server = SessionServer(throttle=False)
+        bad = server.add("bad", bytes.fromhex("6001 8008"))
+        good = server.add("good", bytes.fromhex("1200"))
+        waiting = bad.subscribe()
+        await server.serve(str(tmp_path / "chip8.sock"))
+        reader, writer = await asyncio.open_unix_connection(str(tmp_path / "chip8.sock"))
+        writer.write(b"bad\n")
+        await writer.drain()
+        with pytest.raises(asyncio.IncompleteReadError):
+            await asyncio.wait_for(read_frame(reader), 5)
+        writer.close()
+        await asyncio.sleep(0)
+        stats = server.stats()
+        running = not good.task.done()
+        await server.close()
+        return await waiting.get(), stats, running
+
+    sentinel, stats, running = asyncio.run(scenario())
+    assert sentinel is None and running
+    assert stats["bad"]["failed"] and stats["bad"]["error"] == "IllegalInstruction: Unknown opcode 0x8008 at 0x202"
+    assert not stats["good"]["failed"] and stats["good"]["frames"] > 0
+
+
+def test_audio(tmp_path):
+    import threading
+    import wave
+    from array import array
+    from audio import Audio, NullAudioSink, PatternTone, RingBuffer, WavAudioSink
+    from scheduler import FrameScheduler
+    emu = Emulator(instructions_per_frame=10)
+    # beep for 6 frames after a 4 frame delay, then idle
+    load_program(emu, [0x6004, 0xF015, 0xF107, 0x3100, 0x1204, 0x6106, 0xF118, 0x120E])
+    audio = Audio(WavAudioSink(tmp_path / "beep.wav"))
+    assert FrameScheduler(emu, throttle=False, audio=audio).run(frames=20) == 20
+    audio.close()
+    with wave.open(str(tmp_path / "beep.wav")) as file:
+        assert (file.getnchannels(), file.getsampwidth(), file.getframerate()) == (1, 2, 44100)
+        samples = array("h", file.readframes(file.getnframes()))
+    assert len(samples) == 20 * 735
+    sounding = [any(samples[frame * 735:(frame + 1) * 735]) for frame in range(20)]
+    on = [frame for frame in range(20) if sounding[frame]]
+    assert on == list(range(4, 10))
+
+    # FX18 with N sounds for exactly N frames, short beeps included
+    for beep in (1, 2, 3):
+        emu = Emulator(instructions_per_frame=10)
+        load_program(emu, [0x6004, 0xF015, 0xF107, 0x3100, 0x1204, 0x6100 | beep, 0xF118, 0x120E])
+        audio = Audio(WavAudioSink(tmp_path / f"beep{beep}.wav"))
+        FrameScheduler(emu, throttle=False, audio=audio).run(frames=20)
+        audio.close()
+        with wave.open(str(tmp_path / f"beep{beep}.wav")) as file:
+            samples = array("h", file.readframes(file.getnframes()))
+        assert sum(any(samples[frame * 735:(frame + 1) * 735]) for frame in range(20)) == beep
+
+    # a sink stuck on its device holds up only the consumer thread
+    class StuckSink(NullAudioSink):
+        def __init__(self):
+            super().__init__()
+            self.release = threading.Event()
+
+        def write(self, samples):
+            self.release.wait()
+            super().write(samples)
+
+    sink = StuckSink()
+    audio = Audio(sink)
+    for _ in range(30):
+        audio.frame(True)
+    assert audio.frames == 30 and sink.samples == 0
+    sink.release.set()
+    audio.close()
+    assert sink.samples == 30 * 735 and audio.buffer.overruns == 0
+
+    assert [Audio(rate=48000).frame_length(frame) for frame in range(3)] == [800] * 3
+    assert sum(Audio(rate=22050).frame_length(frame) for frame in range(60)) == 22050
+    pattern = PatternTone(bytes([0xFF] * 8 + [0x00] * 8), pitch=64)
+    # 64 lit bits at 4000 bits a second last 705.6 samples
+    first = array("h", pattern.samples(800))
+    assert len(first) == 800 and min(first[:705]) > 0 and max(first[706:800]) < 0
+    ring = RingBuffer(4)
+    ring.write(bytes(range(12)))
+    assert ring.overruns == 2 and ring.read(6) == bytes(range(4, 12)) + bytes(4) and ring.underruns == 2